@@ -1,7 +1,25 @@
 #!/usr/bin/env python3
 import sys
+import os
 import re
-import string
+import io
+import glob
+import mmap
+import codecs
+import argparse
+import tempfile
+import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy as np
+except ImportError:
+    # Optional: without numpy every file goes through the decoding path
+    np = None
+
+# Bytes read per chunk when streaming a file; memory use is bounded by this plus the longest line
+CHUNK_SIZE = 1 << 20
 
 def is_srt_timestamp(line):
     # Matches standard SRT timestamp: 00:00:00,000 --> 00:00:00,000
@@ -9,18 +27,498 @@ def is_srt_timestamp(line):
     pattern = r'^\d{1,2}:\d{2}:\d{2}[,.]\d{3}\s-->\s\d{1,2}:\d{2}:\d{2}[,.]\d{3}'
     return re.match(pattern, line.strip()) is not None
 
-def count_stats(file_path):
+# Bytes inspected at the start of a file to pick its encoding
+SNIFF_SIZE = 64 * 1024
+
+# Byte order marks, longest first so UTF-32 LE is not mistaken for UTF-16 LE
+BOMS = [
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# Legacy double-byte encodings tried when the prefix is not valid UTF-8
+LEGACY_ENCODINGS = ('gbk', 'shift_jis', 'big5')
+
+class ReplaceCounter:
+    """Codec error handler that replaces undecodable bytes with U+FFFD (never counted) and tallies them.
+
+    Each instance is registered under its own name, so readers decoding at the same time keep separate
+    counts. The codec registry never forgets a handler, so released instances are pooled and reused.
+    """
+
+    _pool = []
+
+    def __init__(self):
+        self.name = f'count_chars.replace.{id(self)}'
+        self.count = 0
+        codecs.register_error(self.name, self)
+
+    def __call__(self, error):
+        self.count += error.end - error.start
+        return '\ufffd', error.end
+
+    @classmethod
+    def acquire(cls):
+        try:
+            counter = cls._pool.pop()
+        except IndexError:
+            counter = cls()
+        counter.count = 0
+        return counter
+
+    def release(self):
+        self._pool.append(self)
+
+def is_common_char(char, encoding):
+    """Whether a non-ASCII char decoded with a legacy encoding is typical text for that encoding"""
+    code = ord(char)
+    if encoding == 'shift_jis':
+        # Kana, or JIS symbols / level-1 kanji (lead bytes 0x81-0x9F); half-width katakana is rare in real text
+        if 0x3040 <= code <= 0x30FF:
+            return True
+        lead = char.encode('shift_jis')[0]
+        return 0x81 <= lead <= 0x9F
+    if encoding == 'big5':
+        # Big5 symbols and level-1 (frequent) hanzi
+        lead = char.encode('big5')[0]
+        return 0xA1 <= lead <= 0xC6
+    # GBK: the GB2312 subset covers the everyday simplified characters
+    try:
+        char.encode('gb2312')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+def detect_encoding(sample, final=False, at_start=True):
+    """Pick an encoding from a bounded byte sample: BOM, then UTF-8 validity, then GBK/Shift-JIS/Big5.
+
+    Legacy candidates that fail to decode the sample are dropped; the rest are scored by how many
+    decoded characters are common text for that encoding. final=False tolerates a multi-byte
+    sequence cut off at the end of the sample; at_start=False (a sample from later in the file,
+    after pure-ASCII text) ignores byte order marks.
+    """
+    for bom, encoding in BOMS:
+        if at_start and sample.startswith(bom):
+            return encoding
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final)
+        return 'utf-8'
     except UnicodeDecodeError:
+        pass
+    best, best_score = None, None
+    for encoding in LEGACY_ENCODINGS:
         try:
-             with open(file_path, 'r', encoding='gbk') as f:
-                lines = f.readlines()
-        except Exception as e:
-            print(f"Error reading file {file_path}: {e}")
-            return
+            text = codecs.getincrementaldecoder(encoding)().decode(sample, final)
+        except UnicodeDecodeError:
+            continue
+        score = sum(1 if is_common_char(char, encoding) else -1 for char in text if ord(char) >= 0x80)
+        if best_score is None or score > best_score:
+            best, best_score = encoding, score
+    # Nothing decodes cleanly: fall back to UTF-8 and let the bad bytes be replaced
+    return best or 'utf-8'
+
+class LineReader:
+    """Iterable over the lines of a file, read exactly once in fixed-size binary chunks.
+
+    When encoding is None it is detected from the whole first chunk that contains non-ASCII bytes,
+    before that same chunk is decoded; every candidate decodes ASCII identically, so chunks before it
+    are decoded as ASCII while the choice is postponed, and nothing is read twice. Newlines are normalised the same way as
+    text-mode open() ('\\r\\n' and '\\r' become '\\n'), and a line that straddles a chunk boundary is
+    buffered until it is complete, so memory stays flat regardless of file size. Bytes that turn
+    out to be invalid later in the file are replaced instead of restarting; `replaced` counts them.
+    """
+
+    def __init__(self, file_path, encoding=None, chunk_size=CHUNK_SIZE):
+        self.file_path = file_path
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.replaced = 0
+
+    def blocks(self):
+        """Yield the decoded text about one chunk at a time, always cut just after a newline (except at EOF)"""
+        counter = ReplaceCounter.acquire()
+        partial = []
+        # The byte decoder is created once the encoding is known; newline handling spans the switch
+        decoder = None if self.encoding is None else codecs.getincrementaldecoder(self.encoding)(counter.name)
+        newlines = io.IncrementalNewlineDecoder(None, translate=True)
+        try:
+            with open(self.file_path, 'rb') as f:
+                wanted = max(self.chunk_size, SNIFF_SIZE)
+                chunk = f.read(wanted)
+                at_start = True
+                while chunk:
+                    if decoder is None:
+                        if chunk.isascii():
+                            text = newlines.decode(chunk.decode('ascii'))
+                        else:
+                            self.encoding = detect_encoding(chunk, final=len(chunk) < wanted, at_start=at_start)
+                            decoder = codecs.getincrementaldecoder(self.encoding)(counter.name)
+                    if decoder is not None:
+                        text = newlines.decode(decoder.decode(chunk))
+                    cut = text.rfind('\n') + 1
+                    if cut:
+                        partial.append(text[:cut])
+                        yield ''.join(partial)
+                        partial = []
+                    partial.append(text[cut:])
+                    wanted = self.chunk_size
+                    chunk = f.read(wanted)
+                    at_start = False
+                if decoder is None:
+                    # Nothing but ASCII: report it the way a BOM-less UTF-8 file is reported
+                    self.encoding = detect_encoding(b'', final=True)
+                    partial.append(newlines.decode('', final=True))
+                else:
+                    partial.append(newlines.decode(decoder.decode(b'', final=True), final=True))
+            rest = ''.join(partial)
+            if rest:
+                yield rest
+        finally:
+            self.replaced = counter.count
+            counter.release()
+
+    def __iter__(self):
+        for block in self.blocks():
+            lines = block.split('\n')
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
 
+# Character classes. A block is encoded as UTF-16-BE and its high and low bytes are translated
+# separately to bit sets; ANDing the two leaves every code unit with exactly one of these values.
+CLASS_OTHER, CLASS_WORD, CLASS_KANA, CLASS_HAN = 0, 1, 2, 4
+# High byte: 0x00 may be an ASCII letter/digit, 0x30 may be kana (3040-30FF), 0x4E-0x9F is always CJK (4E00-9FFF)
+HIGH_BYTE_CLASSES = bytes(
+    CLASS_WORD if high == 0x00 else
+    CLASS_KANA if high == 0x30 else
+    CLASS_HAN if 0x4E <= high <= 0x9F else
+    CLASS_OTHER
+    for high in range(256))
+# Low byte: which of the above it completes ([a-zA-Z0-9] for WORD, 0x40-0xFF for KANA, anything for HAN)
+LOW_BYTE_CLASSES = bytes(
+    (CLASS_WORD if chr(low).isascii() and chr(low).isalnum() else 0)
+    | (CLASS_KANA if low >= 0x40 else 0)
+    | CLASS_HAN
+    for low in range(256))
+# Class string -> b'w' for word characters and a space for the rest, so each word starts at b' w' or at offset 0
+WORD_RUNS = bytes(ord('w') if cls == CLASS_WORD else ord(' ') for cls in range(256))
+
+def classify(text):
+    """Count CJK characters and [a-zA-Z0-9]+ runs in text in a few C-level passes; returns (cjk, words)
+
+    Equivalent to the regex counting in count_lines for any text, including surrogates for
+    characters outside the BMP (their high bytes 0xD8-0xDF map to CLASS_OTHER).
+    """
+    data = text.encode('utf-16-be', 'surrogatepass')
+    units = len(data) // 2
+    high = int.from_bytes(data[0::2].translate(HIGH_BYTE_CLASSES), 'big')
+    low = int.from_bytes(data[1::2].translate(LOW_BYTE_CLASSES), 'big')
+    classes = (high & low).to_bytes(units, 'big')
+    cjk = classes.count(CLASS_HAN) + classes.count(CLASS_KANA)
+    runs = classes.translate(WORD_RUNS)
+    words = runs.count(b' w') + runs.startswith(b'w')
+    return cjk, words
+
+def is_subtitle(file_path):
+    return file_path.lower().endswith(('.srt', '.vtt'))
+
+# Lines skipped in subtitles, searched in '\n' + block (the literal leading newline lets the regex engine
+# jump from line to line): the is_srt_timestamp pattern kept on one line, and lines holding a single
+# run of word characters, a superset of isdigit() lines that is confirmed per word
+SUBTITLE_TIMESTAMP_LINE = re.compile(
+    r'\n[^\S\n]*\d{1,2}:\d{2}:\d{2}[,.]\d{3}[^\S\n]-->[^\S\n]\d{1,2}:\d{2}:\d{2}[,.]\d{3}.*')
+SUBTITLE_WORD_LINE = re.compile(r'\n[^\S\n]*(\w+)[^\S\n]*$', re.MULTILINE)
+
+def count_text(blocks, file_path):
+    """Count CJK characters and English words over an iterable of text blocks; returns (cjk, words)
+
+    Same results as count_lines, provided no line is split across two blocks. Each block is
+    classified as a whole; for subtitles the timestamp and index lines are gathered and classified
+    together, then subtracted back out.
+    """
+    total_cjk_chars = 0
+    total_english_words = 0
+    subtitle = is_subtitle(file_path)
+    for block in blocks:
+        cjk, words = classify(block)
+        if subtitle:
+            block = '\n' + block
+            skipped = SUBTITLE_TIMESTAMP_LINE.findall(block)
+            skipped.extend(word for word in SUBTITLE_WORD_LINE.findall(block) if word.isdigit())
+            skipped_cjk, skipped_words = classify('\n'.join(skipped))
+            cjk -= skipped_cjk
+            words -= skipped_words
+        total_cjk_chars += cjk
+        total_english_words += words
+    return total_cjk_chars, total_english_words
+
+# Files at least this large are counted from a memory map when numpy is available and they are UTF-8
+FAST_PATH_MIN_SIZE = 1 << 20
+# Bytes classified per step on the fast path (extended to the next line break)
+FAST_CHUNK_SIZE = 4 << 20
+
+# Byte classes for the UTF-8 fast path; a single bytes.translate gives every byte of a chunk its class.
+# ASCII first, then UTF-8 continuation and lead bytes, so "is a lead" and "is non-ASCII" are range tests.
+(BYTE_OTHER, BYTE_LETTER, BYTE_DIGIT, BYTE_SPACE, BYTE_NEWLINE, BYTE_CONTINUATION,
+ BYTE_LEAD2, BYTE_LEAD3, BYTE_KANA_LEAD, BYTE_E4, BYTE_HAN_LEAD, BYTE_LEAD4, BYTE_INVALID) = range(13)
+
+def _utf8_byte_class(byte):
+    char = chr(byte)
+    if byte < 0x80:
+        if char.isalpha():
+            return BYTE_LETTER
+        if char.isdigit():
+            return BYTE_DIGIT
+        if char in '\r\n':
+            return BYTE_NEWLINE
+        # Whitespace that str.strip() and \s treat as such inside a line
+        return BYTE_SPACE if char.isspace() else BYTE_OTHER
+    if byte < 0xC0:
+        return BYTE_CONTINUATION
+    if byte < 0xC2 or byte > 0xF4:
+        return BYTE_INVALID
+    if byte < 0xE0:
+        return BYTE_LEAD2
+    if byte == 0xE3:
+        # 3040-30FF (kana) is E3 81 80 - E3 83 BF
+        return BYTE_KANA_LEAD
+    if byte == 0xE4:
+        # 4E00 is E4 B8 80
+        return BYTE_E4
+    if 0xE5 <= byte <= 0xE9:
+        # Always 5000-9FFF
+        return BYTE_HAN_LEAD
+    return BYTE_LEAD3 if byte < 0xF0 else BYTE_LEAD4
+
+UTF8_BYTE_CLASSES = bytes(_utf8_byte_class(byte) for byte in range(256))
+# Lead bytes whose second byte is narrower than 80-BF: overlong forms, surrogates, beyond U+10FFFF
+UTF8_SECOND_BYTE_RANGES = {0xE0: (0xA0, 0xBF), 0xED: (0x80, 0x9F), 0xF0: (0x90, 0xBF), 0xF4: (0x80, 0x8F)}
+# Lead bytes that start a CJK character when followed by a second byte in this range
+CJK_SECOND_BYTE_RANGES = ((BYTE_E4, 0xB8, 0xBF), (BYTE_KANA_LEAD, 0x81, 0x83))
+
+def utf8_classes(chunk):
+    """Byte classes of chunk as a uint8 array, or None unless it is complete, strictly valid UTF-8
+
+    Validity is what makes the byte-level counts equal to those of the decoded text.
+    """
+    class_bytes = chunk.translate(UTF8_BYTE_CLASSES)
+    if BYTE_INVALID in class_bytes:
+        return None
+    classes = np.frombuffer(class_bytes, np.uint8)
+    # Byte i must be a continuation exactly when a lead 1, 2 or 3 places back says so
+    expected = np.zeros(len(classes), bool)
+    expected[1:] = classes[:-1] >= BYTE_LEAD2
+    expected[2:] |= classes[:-2] >= BYTE_LEAD3
+    expected[3:] |= classes[:-3] == BYTE_LEAD4
+    if not np.array_equal(classes == BYTE_CONTINUATION, expected):
+        return None
+    # Sequence cut off by the end of the chunk
+    for back, lead in ((1, BYTE_LEAD2), (2, BYTE_LEAD3), (3, BYTE_LEAD4)):
+        if len(classes) >= back and classes[-back] >= lead:
+            return None
+    data = np.frombuffer(chunk, np.uint8)
+    for lead, (low, high) in UTF8_SECOND_BYTE_RANGES.items():
+        if lead in chunk:
+            second = data[np.flatnonzero(data[:-1] == lead) + 1]
+            if ((second < low) | (second > high)).any():
+                return None
+    return classes
+
+def character_starts(chunk, classes):
+    """Masks of the first byte of every CJK character and of every [a-zA-Z0-9]+ run; returns (cjk, words)
+
+    Multi-byte characters are never ASCII letters or digits, so they end a run just like the regex does.
+    """
+    data = np.frombuffer(chunk, np.uint8)
+    cjk = classes == BYTE_HAN_LEAD
+    for lead, low, high in CJK_SECOND_BYTE_RANGES:
+        positions = np.flatnonzero(classes[:-1] == lead)
+        second = data[positions + 1]
+        cjk[positions[(second >= low) & (second <= high)]] = True
+    alnum = (classes == BYTE_LETTER) | (classes == BYTE_DIGIT)
+    words = alnum.copy()
+    words[1:] &= ~alnum[:-1]
+    return cjk, words
+
+# is_srt_timestamp for a line that is pure ASCII up to the end of its second time, as (offset, rule)
+# pairs: before and after the '-->', then after the second time's hour, whose length varies. A rule
+# is 'd' for a digit, 's' for whitespace, or the allowed byte values. A two-digit first hour moves
+# the line start back by one; that is checked separately.
+_TIMESTAMP_BEFORE_ARROW = ((-12, 'd'), (-11, b':'), (-10, 'd'), (-9, 'd'), (-8, b':'), (-7, 'd'), (-6, 'd'),
+                           (-5, b',.'), (-4, 'd'), (-3, 'd'), (-2, 'd'), (-1, 's'))
+_TIMESTAMP_AFTER_ARROW = ((3, 's'), (4, 'd'))
+_TIMESTAMP_AFTER_HOUR = ((0, b':'), (1, 'd'), (2, 'd'), (3, b':'), (4, 'd'), (5, 'd'), (6, b',.'),
+                         (7, 'd'), (8, 'd'), (9, 'd'))
+
+def _bytes_match(data, classes, positions, rules, line_starts, line_ends):
+    """Whether every (offset, rule) holds at each position, staying inside its line"""
+    size = len(classes)
+    ok = np.ones(len(positions), bool)
+    for offset, rule in rules:
+        at = positions + offset
+        ok &= (at >= line_starts) & (at < line_ends)
+        at = np.clip(at, 0, size - 1)
+        if rule == 'd':
+            ok &= classes[at] == BYTE_DIGIT
+        elif rule == 's':
+            ok &= classes[at] == BYTE_SPACE
+        else:
+            ok &= np.isin(data[at], list(rule))
+    return ok
+
+def _count_per_line(mask, starts):
+    """Number of set bytes in each line, the lines running from one start to the next"""
+    positions = np.flatnonzero(mask)
+    return np.diff(np.searchsorted(positions, starts), append=len(positions))
+
+def skipped_subtitle_counts(chunk, classes, cjk_starts, word_starts):
+    """CJK characters and words on the timestamp and index lines of a valid UTF-8 chunk; returns (cjk, words)
+
+    Pure-ASCII index and timestamp lines are recognised on the byte classes. Lines that could only
+    match through non-ASCII whitespace or digits, leading whitespace, or repeated arrows are decoded
+    and checked exactly like count_lines does.
+    """
+    data = np.frombuffer(chunk, np.uint8)
+    size = len(classes)
+    breaks = np.flatnonzero(classes == BYTE_NEWLINE)
+    starts = np.concatenate(([0], breaks + 1))
+    ends = np.concatenate((breaks, [size]))
+    if starts[-1] == size:
+        starts, ends = starts[:-1], ends[:-1]
+    if not len(starts):
+        return 0, 0
+    line_cjk = _count_per_line(cjk_starts, starts)
+    line_words = _count_per_line(word_starts, starts)
+
+    # Index lines: only ASCII whitespace and a single run of digits. With other non-ASCII characters
+    # (never CJK, which is not a digit) it takes a real isdigit() to tell.
+    has_ascii_text = np.logical_or.reduceat(classes <= BYTE_LETTER, starts)
+    has_non_ascii = np.logical_or.reduceat(classes >= BYTE_CONTINUATION, starts)
+    digits_only = ~has_ascii_text & (line_words > 0)
+    skipped_words = np.count_nonzero(digits_only & ~has_non_ascii & (line_words == 1))
+    to_check = [np.flatnonzero(digits_only & has_non_ascii & (line_cjk == 0))]
+
+    # Timestamp lines: a single '-->' at the fixed offsets of the pattern, starting the line
+    greater = np.flatnonzero(data == ord('>'))
+    greater = greater[greater >= 2]
+    arrows = greater[(data[greater - 1] == ord('-')) & (data[greater - 2] == ord('-'))] - 2
+    arrow_lines = np.searchsorted(starts, arrows, 'right') - 1
+    single = np.bincount(arrow_lines, minlength=len(starts))[arrow_lines] == 1
+    line_starts, line_ends = starts[arrow_lines], ends[arrow_lines]
+    two_digit_hour = (arrows - 13 >= line_starts) & (classes[np.clip(arrows - 13, 0, size - 1)] == BYTE_DIGIT)
+    pure = single & (arrows - 12 - two_digit_hour == line_starts)
+    pure &= _bytes_match(data, classes, arrows, _TIMESTAMP_BEFORE_ARROW, line_starts, line_ends)
+    pure &= _bytes_match(data, classes, arrows, _TIMESTAMP_AFTER_ARROW, line_starts, line_ends)
+    hour_end = arrows + 5 + (classes[np.clip(arrows + 5, 0, size - 1)] == BYTE_DIGIT)
+    pure &= _bytes_match(data, classes, hour_end, _TIMESTAMP_AFTER_HOUR, line_starts, line_ends)
+    to_check.append(arrow_lines[~pure])
+
+    checked = [line for line in np.unique(np.concatenate(to_check))
+               if _is_skipped_subtitle_line(chunk[starts[line]:ends[line]])]
+    skipped = np.concatenate((arrow_lines[pure], np.array(checked, dtype=arrow_lines.dtype)))
+    skipped_words += line_words[skipped].sum()
+    return int(line_cjk[skipped].sum()), int(skipped_words)
+
+def _is_skipped_subtitle_line(line):
+    line = line.decode('utf-8').strip()
+    return is_srt_timestamp(line) or line.isdigit()
+
+def line_chunks(mm, size, start=0, chunk_size=FAST_CHUNK_SIZE):
+    """Yield (start, end) spans of about chunk_size bytes from start on, each ending just after a line break"""
+    while start < size:
+        end = start + chunk_size
+        if end >= size:
+            end = size
+        else:
+            cut = mm.find(b'\n', end, end + chunk_size)
+            if cut < 0:
+                cut = mm.find(b'\r', end, end + chunk_size)
+            if cut < 0:
+                cut = mm.find(b'\n', end)
+            end = size if cut < 0 else cut + 1
+        yield start, end
+        start = end
+
+def count_utf8_file(file_path):
+    """Count a large UTF-8 file from a memory map without decoding it; returns (encoding, cjk, words)
+
+    Returns None when the fast path does not apply (numpy missing, small file, another encoding,
+    or invalid UTF-8 anywhere), leaving the file to the decoding path so results never differ.
+    """
+    if np is None:
+        return None
+    subtitle = is_subtitle(file_path)
+    total_cjk_chars = 0
+    total_english_words = 0
+    with open(file_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < FAST_PATH_MIN_SIZE:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            encoding = detect_encoding(mm[:SNIFF_SIZE], final=size <= SNIFF_SIZE)
+            if encoding not in ('utf-8', 'utf-8-sig'):
+                return None
+            # utf-8-sig drops the BOM when decoding; leave it out here too so it does not join line 1
+            offset = len(codecs.BOM_UTF8) if encoding == 'utf-8-sig' else 0
+            for start, end in line_chunks(mm, size, offset):
+                chunk = mm[start:end]
+                classes = utf8_classes(chunk)
+                if classes is None:
+                    return None
+                cjk_starts, word_starts = character_starts(chunk, classes)
+                cjk = np.count_nonzero(cjk_starts)
+                words = np.count_nonzero(word_starts)
+                if subtitle:
+                    skipped_cjk, skipped_words = skipped_subtitle_counts(chunk, classes, cjk_starts, word_starts)
+                    cjk -= skipped_cjk
+                    words -= skipped_words
+                total_cjk_chars += cjk
+                total_english_words += words
+    return encoding, int(total_cjk_chars), int(total_english_words)
+
+def count_file(file_path, fast=True):
+    """Count one file; returns (path, encoding, replaced, cjk, words, error). Picklable for worker processes.
+
+    With fast=True large UTF-8 files go through count_utf8_file when numpy is installed.
+    """
+    if fast:
+        try:
+            counted = count_utf8_file(file_path)
+        except OSError as e:
+            return file_path, None, 0, 0, 0, str(e)
+        if counted:
+            encoding, cjk, words = counted
+            return file_path, encoding, 0, cjk, words, None
+    reader = LineReader(file_path)
+    try:
+        cjk, words = count_text(reader.blocks(), file_path)
+    except OSError as e:
+        return file_path, None, 0, 0, 0, str(e)
+    return file_path, reader.encoding, reader.replaced, cjk, words, None
+
+def count_stats(file_path, fast=True):
+    _, encoding, replaced, total_cjk_chars, total_english_words, error = count_file(file_path, fast)
+    if error:
+        print(f"Error reading file {file_path}: {error}")
+        return
+
+    print(f"File: {file_path}")
+    if replaced:
+        print(f"Encoding: {encoding} ({replaced} undecodable bytes ignored)")
+    else:
+        print(f"Encoding: {encoding}")
+    print(f"CJK Characters: {total_cjk_chars}")
+    print(f"English Words: {total_english_words}")
+    print(f"Total: {total_cjk_chars + total_english_words}")
+
+def count_lines(lines, file_path):
+    """Count CJK characters and English words over an iterable of lines; returns (cjk, words)
+
+    The original per-line regex implementation, kept as the reference for count_text and --benchmark.
+    """
     total_cjk_chars = 0
     total_english_words = 0
     
@@ -68,15 +566,176 @@ def count_stats(file_path):
         eng_words = re.findall(r'[a-zA-Z0-9]+', no_cjk)
         total_english_words += len(eng_words)
 
-    print(f"File: {file_path}")
-    print(f"CJK Characters: {total_cjk_chars}")
-    print(f"English Words: {total_english_words}")
-    print(f"Total: {total_cjk_chars + total_english_words}")
+    return total_cjk_chars, total_english_words
 
-if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python3 count_char.py <file_path>")
+# Extensions picked up when walking a directory (files named explicitly are always counted)
+DEFAULT_EXTENSIONS = ('.srt', '.vtt', '.ass', '.ssa', '.txt', '.md')
+
+def expand_paths(paths, extensions):
+    """Expand files, directories (recursively, filtered by extension) and glob patterns into unique file paths"""
+    files = []
+    seen = set()
+
+    def add(path):
+        key = os.path.realpath(path)
+        if key not in seen:
+            seen.add(key)
+            files.append(path)
+
+    def walk(directory):
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(extensions):
+                    add(os.path.join(root, name))
+
+    for path in paths:
+        if os.path.isdir(path):
+            walk(path)
+        elif os.path.exists(path):
+            add(path)
+        elif glob.has_magic(path):
+            matches = sorted(glob.glob(path, recursive=True))
+            if not matches:
+                print(f"No files match: {path}", file=sys.stderr)
+            for match in matches:
+                if os.path.isdir(match):
+                    walk(match)
+                else:
+                    add(match)
+        else:
+            # Let count_file report it like any other unreadable file
+            add(path)
+    return files
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def count_files(files, jobs, fast=True):
+    """Count files across a process pool, largest first so a big file does not start last; yields results as they finish"""
+    files = sorted(files, key=file_size, reverse=True)
+    count = partial(count_file, fast=fast)
+    if jobs <= 1 or len(files) <= 1:
+        yield from map(count, files)
+        return
+    with ProcessPoolExecutor(max_workers=min(jobs, len(files))) as pool:
+        # One future per file: per-file work is large and uneven, and a slow file must not hold back the rest
+        futures = [pool.submit(count, file_path) for file_path in files]
+        for future in as_completed(futures):
+            yield future.result()
+
+def print_table(results):
+    results = sorted(results, key=lambda result: result[0])
+    total_cjk = total_words = 0
+    print(f"{'CJK':>10} {'Words':>10} {'Total':>10}  {'Encoding':<10} File")
+    for path, encoding, replaced, cjk, words, error in results:
+        if error:
+            print(f"Error reading file {path}: {error}")
+            continue
+        total_cjk += cjk
+        total_words += words
+        note = f" ({replaced} undecodable bytes ignored)" if replaced else ""
+        print(f"{cjk:>10} {words:>10} {cjk + words:>10}  {encoding:<10} {path}{note}")
+    counted = sum(1 for result in results if not result[5])
+    print(f"{total_cjk:>10} {total_words:>10} {total_cjk + total_words:>10}  {'':<10} TOTAL ({counted} files)")
+
+def parse_extensions(values):
+    if not values:
+        return DEFAULT_EXTENSIONS
+    extensions = []
+    for value in values:
+        for ext in value.split(','):
+            ext = ext.strip().lower()
+            if ext:
+                extensions.append(ext if ext.startswith('.') else '.' + ext)
+    return tuple(extensions)
+
+def run_benchmark(sample, size_mb):
+    """Time the reference regex counter against the classifier on a corpus of sample repeated to size_mb MB"""
+    with open(sample, 'rb') as f:
+        data = f.read()
+    if not data:
+        print(f"Benchmark sample is empty: {sample}")
+        return False
+    # A byte order mark goes at the start of the corpus only, so a BOM'd first line is part of the check
+    bom = next((bom for bom, _ in BOMS if data.startswith(bom)), b'')
+    data = data[len(bom):]
+    if bom in (b'', codecs.BOM_UTF8) and not data.endswith(b'\n'):
+        data += b'\n'
+    # Keep the sample's extension so subtitle lines are skipped the same way
+    fd, corpus = tempfile.mkstemp(suffix=os.path.splitext(sample)[1])
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(bom)
+            size = len(bom)
+            while size < size_mb << 20:
+                f.write(data)
+                size += len(data)
+        size_mb = size / (1 << 20)
+        print(f"Corpus: {size_mb:.0f} MB ({sample} repeated)")
+        def fast_path():
+            counted = count_utf8_file(corpus)
+            return counted[1:] if counted else (None, None)
+
+        runs = [("regex", lambda: count_lines(LineReader(corpus), corpus)),
+                ("classifier", lambda: count_text(LineReader(corpus).blocks(), corpus))]
+        if np is not None:
+            runs.append(("numpy", fast_path))
+        results = []
+        for name, run in runs:
+            start = time.perf_counter()
+            cjk, words = run()
+            elapsed = time.perf_counter() - start
+            if cjk is None:
+                print(f"{name:<12} not applicable (corpus is not valid UTF-8)")
+                continue
+            results.append((name, (cjk, words), elapsed))
+            print(f"{name:<12} {elapsed:8.2f} s {size_mb / elapsed:8.1f} MB/s   CJK {cjk}  Words {words}")
+        if np is None:
+            print(f"{'numpy':<12} not installed, fast path skipped")
+    finally:
+        os.remove(corpus)
+    _, expected, regex_time = results[0]
+    matched = True
+    for name, actual, elapsed in results[1:]:
+        if actual != expected:
+            print(f"MISMATCH: {name} and regex counts differ")
+            matched = False
+        else:
+            print(f"{name} counts match, speedup {regex_time / elapsed:.1f}x")
+    return matched
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count CJK characters and English words in text/subtitle files. "
+                    "SRT/VTT timestamp and index lines are ignored.")
+    parser.add_argument("paths", nargs='+', help="Files, directories (searched recursively) or glob patterns")
+    parser.add_argument("-e", "--ext", action='append',
+                        help="Extension to include when walking directories; repeatable or comma-separated "
+                             f"(default: {','.join(DEFAULT_EXTENSIONS)})")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1,
+                        help="Worker processes (default: number of CPUs)")
+    parser.add_argument("--no-numpy", action='store_true',
+                        help="Always decode files, even when numpy could count a large UTF-8 file directly")
+    parser.add_argument("--benchmark", type=int, nargs='?', const=1024, metavar="MB",
+                        help="Repeat the first file into a temporary corpus of MB megabytes (default 1024) "
+                             "and compare the regex counter with the classifier on it")
+    args = parser.parse_args()
+
+    files = expand_paths(args.paths, parse_extensions(args.ext))
+    if not files:
+        print("No files to count")
         sys.exit(1)
-    
-    file_path = sys.argv[1]
-    count_stats(file_path)
+    if args.benchmark:
+        sys.exit(0 if run_benchmark(files[0], args.benchmark) else 1)
+    # A single named file keeps the original per-file report
+    if len(files) == 1 and len(args.paths) == 1 and os.path.isfile(args.paths[0]):
+        count_stats(files[0], fast=not args.no_numpy)
+        return
+    print_table(count_files(files, args.jobs, fast=not args.no_numpy))
+
+if __name__ == "__main__":
+    main()
@@ -16,6 +16,26 @@ JAV 视频文件重命名工具
 7. 避免重复重命名已存在的文件
 8. 任务完成时发送桌面通知
 9. 自动跳过名为 "no_need" 的文件夹
+10. 使用本地 SQLite 缓存元数据，已缓存的番号无需联网、无需等待
+11. 远程查询在小型线程池中并发执行，由令牌桶统一限速
+12. 按番号分组，同一番号的视频、字幕、音频等文件只查询一次
+13. 扫描 / 解析 / 应用分阶段执行并落盘，中断后重新运行可从断点继续
+14. 已是规范命名的文件在本地直接识别并跳过，不联网（--recheck 可强制重新校验）
+15. 持久化增量扫描状态，重新运行时只处理新增或变化的文件（--full-rescan 可完整扫描）
+16. 基于 os.scandir 的并发目录遍历，边扫描边把候选文件交给远程查询
+17. 可扩展的番号识别规则（标准、FC2、HEYZO、Carib 等），对候选番号打分以减少误识别
+18. 远程查不到的番号记入负缓存，按指数退避延后重试，期间直接走本地优化
+19. 自适应请求速率与重试，结束时输出请求延迟分位数（p50/p95/p99）和有效请求速率
+20. 可导入批量元数据导出文件作为离线索引，优先于远程查询，支持完全离线运行
+21. 有界预取窗口：处理当前番号时，后续番号的远程查询已在途
+22. 执行前在内存中检查整个重命名计划的目标冲突（忽略大小写），并以不覆盖的原子重命名执行
+23. 每次成功的重命名写入重命名日志，可用 --undo 一次性撤销整批重命名
+24. 监视模式（--watch，仅 Linux）：基于 inotify 常驻运行，只处理新写入或移入的文件，等待仍在增长的文件写完
+25. 同一主机上并发运行的多个实例通过 SQLite 共享一个令牌桶，总请求速率不超过同一上限
+26. 已知厂牌前缀索引（来自缓存、离线索引和附带的种子列表）：前缀未知的低置信度番号延后到最后查询或直接跳过
+27. 可插拔的元数据提供方链：缓存 -> 离线索引 -> 一个或多个远程提供方，慢响应时对冲查询下一个提供方；附带本地桩提供方便于离线测试
+28. --events 输出结构化 JSONL 事件流（带缓冲写入，可供程序读取）；--quiet 只显示单行进度条（速率与预计剩余时间）
+29. 可作为库导入：scan() / resolve() / plan() / apply() 为可组合的生成器，内存占用恒定，共用一个常驻的解析器
 
 使用方法：
 1. 预览模式（默认）：
@@ -24,8 +44,35 @@ JAV 视频文件重命名工具
 2. 执行模式：
    python jav_renamer.py /path/to/videos --execute
 
+3. 忽略缓存并强制刷新元数据：
+   python jav_renamer.py /path/to/videos --refresh
+
+4. 导入离线元数据索引，之后优先从索引解析（--offline 完全不联网）：
+   python jav_renamer.py --import-index dump.csv.gz
+   python jav_renamer.py /path/to/videos --offline
+
+5. 直接应用预览时生成的重命名计划（不扫描、不联网）：
+   python jav_renamer.py --execute --apply-plan ~/.cache/jav_renamer/runs/<目录哈希>/plan.jsonl
+
+6. 按重命名日志撤销整批重命名（不带 --execute 时只预览；有条目核对失败时整批不撤销，加 --undo-force 撤销其余条目）：
+   python jav_renamer.py --execute --undo ~/.cache/jav_renamer/runs/<目录哈希>/journal-<时间戳>.jsonl
+
+7. 常驻监视下载目录，新文件写完后自动重命名：
+   python jav_renamer.py /path/to/downloads --execute --watch
+
+8. 作为库在自己的批处理任务中使用：
+   import jav_renamer as jr
+   resolver = jr.open_resolver()
+   for root in roots:
+       for entry, outcome in jr.apply(jr.plan(jr.resolve(jr.scan(root), resolver)), dry_run=False):
+           ...
+   resolver.close()
+   （plan()/apply() 默认不输出逐文件信息，传 verbose=True 时与命令行输出相同）
+
 注意事项：
-- 默认会等待 5 秒钟以避免 IP 被封
+- 远程请求初始限速为约每 3 秒一次（--rate/--burst 可调），以避免 IP 被封；缓存命中不计入。
+  运行中会根据响应自适应调整：遇到限流/服务端错误/超时降速，持续正常时在 --max-rate 以内小步提速
+  同一主机上同时运行的所有实例共用这一限速（--local-rate-limit 可关闭共享）
 - 不会覆盖已存在的文件
 - 会跳过隐藏文件和非视频文件
 - 需要安装 jvav 库依赖
@@ -43,11 +90,26 @@ JAV 视频文件重命名工具
 import os
 import re
 import sys
+import stat
 import time
+import math
 import argparse
 import subprocess
 import json
-from jvav import JavDbUtil
+import sqlite3
+import hashlib
+import csv
+import gzip
+import ctypes
+import errno
+import select
+import struct
+import unicodedata
+import threading
+from contextlib import contextmanager, nullcontext, redirect_stdout
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+import jvav
 
 # --- 配置 ---
 VIDEO_EXTENSIONS = {'.mp4', '.mkv', '.avi', '.wmv', '.mov', '.flv', '.rmvb', '.m4v'}
@@ -65,32 +127,2073 @@ FILENAME_CLEAN_PATTERNS = [
     r'hhd800\.com@',
 ]
 
+# 原始文件名中常见的发布标签（字幕、清晰度、无码/流出等），不区分大小写；
+# 判断文件名是否已规范时，标题或演员部分只由这些标签组成的视为原始文件名
+RELEASE_TAGS = {
+    '中文字幕', '中字', '字幕', '繁中', '简中', '無碼', '无码', '無修正', '无修正', '破解', '流出',
+    'hd', 'fhd', 'uhd', '4k', '1080p', '720p', 'hevc', 'x264', 'x265',
+    'c', 'ch', 'sub', 'subbed', 'u', 'uc', 'uncensored', 'leak', 'leaked',
+}
+
+# 远程请求限速（令牌桶）：平均每秒请求数与允许的突发请求数，默认约每 3 秒一次，避免IP被封
+DEFAULT_REQUEST_RATE = 1 / 3
+DEFAULT_REQUEST_BURST = 1
+# 自适应限速：遇到 429/5xx/超时速率减半（不低于下限）；连续 HEALTHY_STREAK 次正常响应后速率增加 RATE_INCREASE_STEP（不高于上限）
+DEFAULT_MIN_REQUEST_RATE = 1 / 30
+DEFAULT_MAX_REQUEST_RATE = 1.0
+HEALTHY_STREAK = 10
+RATE_INCREASE_STEP = 0.05
+# 主机级共享限速库：同一台机器上并发运行的所有实例共用一个令牌桶，总请求速率不超过同一上限；
+# 共享桶在 SHARED_BUCKET_IDLE_SECONDS 内有其他实例活动时，新实例沿用其当前速率（含降速结果）
+DEFAULT_RATE_LIMIT_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'jav_renamer', 'ratelimit.sqlite3')
+SHARED_BUCKET_IDLE_SECONDS = 60
+# 暂时性失败的重试次数，以及重试前的退避基数（秒，每次翻倍）
+DEFAULT_LOOKUP_RETRIES = 2
+RETRY_BACKOFF_SECONDS = 5
+# 并发执行远程查询的线程数
+DEFAULT_LOOKUP_WORKERS = 2
+# 对冲请求：首选提供方超过该时长（秒）仍未返回时，并发查询下一个提供方，先返回有效结果者胜出
+DEFAULT_HEDGE_AFTER_SECONDS = 3.0
+# 预取深度：处理当前番号时，最多提前发出后续多少个番号的远程查询
+DEFAULT_LOOKAHEAD = 8
+# 监视模式下，文件大小持续多少秒不变才视为写入完成
+DEFAULT_SETTLE_SECONDS = 5
+
+# 元数据缓存默认位置与有效期（天）
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'jav_renamer', 'metadata.sqlite3')
+DEFAULT_CACHE_TTL_DAYS = 30
+# 离线元数据索引（由批量导出的 CSV/JSONL 导入）默认位置，以及导入时每批写入的行数
+DEFAULT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'jav_renamer', 'index.sqlite3')
+INDEX_IMPORT_BATCH = 10000
+
+# 远程查不到的番号的首次重试间隔（天），之后每失败一次翻倍，最长不超过 MAX_MISS_TTL_DAYS
+DEFAULT_MISS_TTL_DAYS = 1
+MAX_MISS_TTL_DAYS = 30
+
+# 随脚本附带的常见厂牌前缀列表，用于在缓存为空时也能判断番号是否可信
+DEFAULT_PREFIX_SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jav_prefixes.txt')
+
+# 并发列目录的线程数（网络文件系统上每次系统调用都是一次往返，并发可掩盖延迟）
+DEFAULT_SCAN_WORKERS = 8
+
+# 增量扫描状态数据库默认位置
+DEFAULT_SCAN_STATE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'jav_renamer', 'scan_state.sqlite3')
+
+# 运行状态（扫描清单、解析检查点、重命名计划）的默认根目录，每个目标目录对应其下一个子目录
+DEFAULT_WORK_ROOT = os.path.join(os.path.expanduser('~'), '.cache', 'jav_renamer', 'runs')
+MANIFEST_FILENAME = 'manifest.jsonl'
+CHECKPOINT_FILENAME = 'resolved.jsonl'
+PLAN_FILENAME = 'plan.jsonl'
+# 重命名日志每写入多少条执行一次 fsync（结束时总会 fsync）
+JOURNAL_FSYNC_BATCH = 100
+# 结构化事件流的写缓冲区大小（字节），以及安静模式下进度条的最短刷新间隔（秒）
+EVENT_BUFFER_SIZE = 1024 * 1024
+PROGRESS_REFRESH_SECONDS = 0.2
+
+# --- 元数据缓存 ---
+
+class MetadataCache:
+    """基于 SQLite 的元数据缓存，以规范化后的番号为键，记录标题、演员和获取时间"""
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl_days=DEFAULT_CACHE_TTL_DAYS,
+                 miss_ttl_days=DEFAULT_MISS_TTL_DAYS):
+        self.path = path
+        # ttl_days <= 0 表示缓存永不过期
+        self.ttl_seconds = ttl_days * 86400 if ttl_days and ttl_days > 0 else None
+        self.miss_ttl_seconds = miss_ttl_days * 86400
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS metadata ("
+            " jav_id TEXT PRIMARY KEY,"
+            " title TEXT NOT NULL,"
+            " stars TEXT NOT NULL,"
+            " fetched_at REAL NOT NULL)"
+        )
+        # 负缓存：远程查不到的番号及其状态码、连续失败次数和下次允许重试的时间
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS misses ("
+            " jav_id TEXT PRIMARY KEY,"
+            " status INTEGER,"
+            " failures INTEGER NOT NULL,"
+            " last_attempt REAL NOT NULL,"
+            " retry_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def get(self, jav_id):
+        """读取未过期的缓存记录，返回与 get_av_by_id 相同结构的 info 字典；未命中返回 None"""
+        row = self.conn.execute(
+            "SELECT title, stars, fetched_at FROM metadata WHERE jav_id = ?", (jav_id,)
+        ).fetchone()
+        if row is None or (self.ttl_seconds is not None and time.time() - row[2] > self.ttl_seconds):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return {'title': row[0], 'stars': json.loads(row[1])}
+
+    def put(self, jav_id, info):
+        """写入（或覆盖）一条远程获取成功的元数据"""
+        stars = info.get('stars') or []
+        self.conn.execute(
+            "INSERT OR REPLACE INTO metadata (jav_id, title, stars, fetched_at) VALUES (?, ?, ?, ?)",
+            (jav_id, info['title'], json.dumps(stars, ensure_ascii=False, default=str), time.time()),
+        )
+        self.conn.execute("DELETE FROM misses WHERE jav_id = ?", (jav_id,))
+        self.conn.commit()
+
+    def has_prefix(self, prefix):
+        """缓存中是否有以 "prefix-" 开头的番号（主键范围查询，不受有效期限制）"""
+        return self.conn.execute(
+            "SELECT 1 FROM metadata WHERE jav_id >= ? AND jav_id < ? LIMIT 1", (prefix + '-', prefix + '.')
+        ).fetchone() is not None
+
+    def get_miss(self, jav_id):
+        """番号处于重试等待期内时返回 (状态码, 连续失败次数)，否则返回 None"""
+        row = self.conn.execute(
+            "SELECT status, failures, retry_at FROM misses WHERE jav_id = ?", (jav_id,)
+        ).fetchone()
+        if row is None or time.time() >= row[2]:
+            return None
+        self.negative_hits += 1
+        return row[0], row[1]
+
+    def put_miss(self, jav_id, status):
+        """记录一次远程未找到，重试间隔按连续失败次数指数退避"""
+        row = self.conn.execute("SELECT failures FROM misses WHERE jav_id = ?", (jav_id,)).fetchone()
+        failures = (row[0] if row else 0) + 1
+        delay = min(self.miss_ttl_seconds * 2 ** (failures - 1), MAX_MISS_TTL_DAYS * 86400)
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO misses (jav_id, status, failures, last_attempt, retry_at) VALUES (?, ?, ?, ?, ?)",
+            (jav_id, status, failures, now, now + delay),
+        )
+        self.conn.commit()
+
+    def hit_rate(self):
+        """返回本次运行的缓存命中率（0~1），无查询时返回 None"""
+        total = self.hits + self.misses
+        return self.hits / total if total else None
+
+    def close(self):
+        self.conn.close()
+
+# --- 离线元数据索引 ---
+
+def open_text(path):
+    """以文本方式打开文件，.gz 结尾时透明解压"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+def parse_stars(value):
+    """把导出文件中的演员字段统一为演员名列表：支持列表、JSON 数组字符串或以 | 分隔的字符串"""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('['):
+            try:
+                value = json.loads(value)
+            except json.JSONDecodeError:
+                return [value]
+        else:
+            return [name.strip() for name in value.split('|') if name.strip()]
+    names = []
+    for star in value:
+        name = star.get('name') if isinstance(star, dict) else star
+        if name:
+            names.append(str(name))
+    return names
+
+def iter_index_records(path):
+    """流式读取批量导出文件，逐条产出 (番号, 标题, 演员列表)
+
+    按扩展名识别格式：.csv/.tsv 需包含 id（或 jav_id/code）、title、stars 列；
+    其余视为 JSONL，每行一个对象，字段名相同。均支持 .gz 压缩。
+    """
+    base = path[:-3] if path.endswith('.gz') else path
+    ext = os.path.splitext(base)[1].lower()
+    with open_text(path) as f:
+        if ext in ('.csv', '.tsv'):
+            rows = csv.DictReader(f, delimiter='\t' if ext == '.tsv' else ',')
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            raw_id = row.get('id') or row.get('jav_id') or row.get('code')
+            title = row.get('title')
+            if not raw_id or not title:
+                continue
+            raw_id = str(raw_id).strip()
+            jav_id = extract_id_from_filename(raw_id) or raw_id.upper()
+            yield jav_id, str(title).strip(), parse_stars(row.get('stars') or row.get('actors'))
+
+class OfflineIndex:
+    """离线元数据索引：番号 -> 标题/演员，解析时优先于远程查询"""
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.hits = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " jav_id TEXT PRIMARY KEY,"
+            " title TEXT NOT NULL,"
+            " stars TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def import_file(self, path, batch_size=INDEX_IMPORT_BATCH):
+        """流式导入一个导出文件，分批写入，内存占用与文件大小无关；返回导入条数"""
+        imported = 0
+        batch = []
+        for jav_id, title, stars in iter_index_records(path):
+            batch.append((jav_id, title, json.dumps(stars, ensure_ascii=False)))
+            if len(batch) >= batch_size:
+                imported += self._write_batch(batch)
+                batch = []
+        if batch:
+            imported += self._write_batch(batch)
+        return imported
+
+    def _write_batch(self, batch):
+        self.conn.executemany("INSERT OR REPLACE INTO entries (jav_id, title, stars) VALUES (?, ?, ?)", batch)
+        self.conn.commit()
+        return len(batch)
+
+    def get(self, jav_id):
+        """查询索引，返回与 get_av_by_id 相同结构的 info 字典；未收录返回 None"""
+        row = self.conn.execute("SELECT title, stars FROM entries WHERE jav_id = ?", (jav_id,)).fetchone()
+        if row is None:
+            return None
+        self.hits += 1
+        return {'title': row[0], 'stars': json.loads(row[1])}
+
+    def has_prefix(self, prefix):
+        """索引中是否收录了以 "prefix-" 开头的番号（主键范围查询）"""
+        return self.conn.execute(
+            "SELECT 1 FROM entries WHERE jav_id >= ? AND jav_id < ? LIMIT 1", (prefix + '-', prefix + '.')
+        ).fetchone() is not None
+
+    def close(self):
+        self.conn.close()
+
+# --- 远程查询 ---
+
+def is_transient_status(code):
+    """限流和服务端错误属于暂时性失败，不应记入负缓存或检查点"""
+    return code == 429 or (isinstance(code, int) and code >= 500)
+
+class MetadataProvider:
+    """远程元数据提供方接口：fetch(jav_id) 返回 (状态码, info)，info 结构与 jvav 的 get_av_by_id 相同
+
+    rate_limited 为真时，每次请求前都要从 LookupEngine 的令牌桶取令牌，其响应也参与自适应调速。
+    """
+    name = None
+    rate_limited = True
+
+    def fetch(self, jav_id):
+        raise NotImplementedError
+
+class JvavProvider(MetadataProvider):
+    """基于 jvav 各站点工具类（JavDbUtil、JavBusUtil 等）的提供方，每个线程各自持有一个实例（内部含会话）"""
+
+    def __init__(self, name, util_name):
+        self.name = name
+        self.util_class = getattr(jvav, util_name, None)
+        if self.util_class is None:
+            raise ValueError(f"当前安装的 jvav 不提供 {util_name}")
+        self.local = threading.local()
+
+    def fetch(self, jav_id):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            client = self.local.client = self.util_class()
+        return client.get_av_by_id(jav_id, is_nice=False, is_uncensored=False)
+
+class StubProvider(MetadataProvider):
+    """本地桩提供方：从与离线索引同格式的导出文件加载元数据，可模拟响应延迟，用于离线测试提供方链"""
+    rate_limited = False
+
+    def __init__(self, path=None, latency=0.0, name='stub'):
+        self.name = name
+        self.latency = latency
+        self.records = {}
+        if path:
+            for jav_id, title, stars in iter_index_records(path):
+                self.records[jav_id] = {'title': title, 'stars': stars}
+
+    def fetch(self, jav_id):
+        if self.latency:
+            time.sleep(self.latency)
+        info = self.records.get(jav_id)
+        return (200, info) if info else (404, None)
+
+# 可通过 --provider 选择的远程提供方：名称 -> jvav 工具类名
+JVAV_PROVIDERS = {'javdb': 'JavDbUtil', 'javbus': 'JavBusUtil'}
+
+def build_providers(names, stub_path=None, stub_latency=0.0):
+    """按名称顺序构建提供方链，第一个为首选；stub 为本地桩提供方，必须提供数据文件"""
+    providers = []
+    for name in names:
+        if name == 'stub':
+            if not stub_path:
+                raise ValueError("使用 stub 提供方时必须通过 --stub-data 指定数据文件")
+            providers.append(StubProvider(stub_path, stub_latency))
+        elif name in JVAV_PROVIDERS:
+            providers.append(JvavProvider(name, JVAV_PROVIDERS[name]))
+        else:
+            raise ValueError(f"未知的元数据提供方: {name}（可选: {', '.join([*JVAV_PROVIDERS, 'stub'])}）")
+    return providers
+
+def uses_stub_provider(providers):
+    return any(isinstance(provider, StubProvider) for provider in providers or ())
+
+def resolve_cache_path(cache_path, providers):
+    """未显式指定缓存路径时：提供方链含 stub 则使用内存缓存，桩数据和 404 不写入真实缓存；否则使用默认缓存"""
+    if cache_path is not None:
+        return cache_path
+    return ':memory:' if uses_stub_provider(providers) else DEFAULT_CACHE_PATH
+
+def is_valid_result(code, info):
+    return code == 200 and bool(info) and bool(info.get('title'))
+
+class TokenBucket:
+    """线程安全的令牌桶限速器：每秒补充 rate 个令牌，最多积攒 burst 个"""
+
+    def __init__(self, rate=DEFAULT_REQUEST_RATE, burst=DEFAULT_REQUEST_BURST):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        """调整补充速率，已积攒的令牌按旧速率结算"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+
+    def acquire(self):
+        """取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self.lock:
+                self._refill(time.monotonic())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def close(self):
+        pass
+
+class SharedTokenBucket:
+    """跨进程共享的令牌桶，接口与 TokenBucket 相同：速率、令牌数和上次补充时间保存在 SQLite 中
+
+    每次取令牌都在 BEGIN IMMEDIATE 事务中完成，由 SQLite 文件锁在进程间互斥，因此无论同时运行多少个实例，
+    总请求速率都受同一个令牌桶约束。时间使用墙钟（monotonic 时钟无法跨进程比较）。
+    任一实例的自适应调速（如遇到 429 减速）都会写回共享速率，对所有实例生效。
+    """
+
+    def __init__(self, path=DEFAULT_RATE_LIMIT_PATH, rate=DEFAULT_REQUEST_RATE, burst=DEFAULT_REQUEST_BURST,
+                 name='javdb'):
+        if rate <= 0:
+            raise ValueError("rate 必须大于 0")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.name = name
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS buckets ('
+            ' name TEXT PRIMARY KEY, rate REAL NOT NULL, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        with self._transaction():
+            now = time.time()
+            row = self.conn.execute('SELECT rate, updated FROM buckets WHERE name = ?', (name,)).fetchone()
+            if row is not None and now - row[1] < SHARED_BUCKET_IDLE_SECONDS:
+                # 其他实例仍在活动，加入其令牌桶而不是重置速率
+                self.rate = row[0]
+            else:
+                self._store(rate, float(self.capacity), now)
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            self.conn.execute('COMMIT')
+
+    def _load(self, now):
+        """读取共享速率并补充令牌，返回 (rate, tokens)；须在事务中调用"""
+        row = self.conn.execute('SELECT rate, tokens, updated FROM buckets WHERE name = ?', (self.name,)).fetchone()
+        if row is None:
+            return self.rate, float(self.capacity)
+        rate, tokens, updated = row
+        return rate, min(self.capacity, tokens + max(0.0, now - updated) * rate)
+
+    def _store(self, rate, tokens, now):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO buckets (name, rate, tokens, updated) VALUES (?, ?, ?, ?)',
+            (self.name, rate, tokens, now),
+        )
+
+    def set_rate(self, rate):
+        """调整共享速率，已积攒的令牌按旧速率结算"""
+        with self._transaction():
+            now = time.time()
+            _, tokens = self._load(now)
+            self._store(rate, tokens, now)
+            self.rate = rate
+
+    def acquire(self):
+        """从共享令牌桶取走一个令牌，令牌不足时阻塞等待"""
+        while True:
+            with self._transaction():
+                now = time.time()
+                self.rate, tokens = self._load(now)
+                if tokens >= 1:
+                    tokens -= 1
+                    wait = 0
+                else:
+                    wait = (1 - tokens) / self.rate
+                self._store(self.rate, tokens, now)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    def close(self):
+        self.conn.close()
+
+def open_rate_limiter(rate_limit_path, rate, burst, name='javdb'):
+    """提供共享限速库路径时返回跨进程共享、名为 name 的令牌桶，否则返回仅在本进程内生效的令牌桶"""
+    if rate_limit_path:
+        return SharedTokenBucket(rate_limit_path, rate, burst, name)
+    return TokenBucket(rate, burst)
+
+class LookupStats:
+    """远程请求统计：每次请求的延迟与状态码（异常记为 None），以及重试次数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.statuses = {}
+        self.retries = 0
+        self.hedges = 0
+        self.wins = {}
+        self.first_start = None
+        self.last_end = None
+
+    def record(self, started, latency, status):
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if self.first_start is None or started < self.first_start:
+                self.first_start = started
+            end = started + latency
+            if self.last_end is None or end > self.last_end:
+                self.last_end = end
+
+    def record_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def record_hedge(self):
+        with self.lock:
+            self.hedges += 1
+
+    def record_win(self, provider_name):
+        with self.lock:
+            self.wins[provider_name] = self.wins.get(provider_name, 0) + 1
+
+    @property
+    def count(self):
+        return len(self.latencies)
+
+    def percentile(self, q):
+        """返回延迟的 q 分位数（最近秩法），无样本返回 None"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = max(0, min(len(ordered) - 1, math.ceil(q / 100 * len(ordered)) - 1))
+        return ordered[index]
+
+    def effective_rate(self):
+        """从第一次请求开始到最后一次请求结束的平均请求速率（次/秒）"""
+        if self.count < 2 or self.last_end <= self.first_start:
+            return None
+        return self.count / (self.last_end - self.first_start)
+
+class LookupEngine:
+    """在线程池中执行远程元数据查询，只有真正发出的网络请求才消耗令牌
+
+    每个需要限速的提供方各有一个令牌桶（open_limiter(提供方名称) 创建，默认为本进程内的 TokenBucket），
+    每次请求都会记录延迟、状态码和重试次数，并据此自适应调整该提供方的速率（AIMD）：
+    限流、服务端错误或异常时速率减半，连续正常响应后小步提速。
+    配置了多个提供方时按顺序对冲：首选提供方的请求发出（取得令牌）后超过 hedge_after 秒未返回、
+    或返回无效结果时，并发查询下一个提供方，先返回有效结果者胜出（落后的请求无法取消，其结果被丢弃）。
+    等待令牌的时间不计入延迟预算，限速本身不会触发对冲。
+    """
+
+    def __init__(self, workers=DEFAULT_LOOKUP_WORKERS, open_limiter=None,
+                 min_rate=DEFAULT_MIN_REQUEST_RATE, max_rate=DEFAULT_MAX_REQUEST_RATE,
+                 retries=DEFAULT_LOOKUP_RETRIES, providers=None, hedge_after=DEFAULT_HEDGE_AFTER_SECONDS):
+        self.retries = max(0, retries)
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='jav-lookup')
+        self.providers = providers or [JvavProvider('javdb', 'JavDbUtil')]
+        self.limiters = {}
+        self.rate_bounds = {}
+        for provider in self.providers:
+            if provider.rate_limited:
+                limiter = open_limiter(provider.name) if open_limiter else TokenBucket()
+                self.limiters[provider] = limiter
+                self.rate_bounds[provider] = (min(min_rate, limiter.rate), max(max_rate, limiter.rate))
+        self.healthy_streaks = {provider: 0 for provider in self.limiters}
+        self.hedge_after = hedge_after
+        self.hedge_executor = None
+        if len(self.providers) > 1:
+            self.hedge_executor = ThreadPoolExecutor(max_workers=max(1, workers) * len(self.providers),
+                                                     thread_name_prefix='jav-hedge')
+        self.stats = LookupStats()
+        self.adapt_lock = threading.Lock()
+        self.closed = False
+
+    def _adapt(self, provider, healthy):
+        limiter = self.limiters[provider]
+        min_rate, max_rate = self.rate_bounds[provider]
+        with self.adapt_lock:
+            if not healthy:
+                self.healthy_streaks[provider] = 0
+                limiter.set_rate(max(min_rate, limiter.rate / 2))
+                return
+            self.healthy_streaks[provider] += 1
+            if self.healthy_streaks[provider] >= HEALTHY_STREAK and limiter.rate < max_rate:
+                self.healthy_streaks[provider] = 0
+                limiter.set_rate(min(max_rate, limiter.rate + RATE_INCREASE_STEP))
+
+    def _call(self, provider, jav_id, sent=None):
+        """向单个提供方发出一次请求并记录统计；取得令牌、请求发出时以发出时刻完成 sent"""
+        limiter = self.limiters.get(provider)
+        if limiter is not None:
+            limiter.acquire()
+        started = time.monotonic()
+        if sent is not None:
+            sent.set_result(started)
+        try:
+            code, info = provider.fetch(jav_id)
+        except Exception:
+            self.stats.record(started, time.monotonic() - started, None)
+            if limiter is not None:
+                self._adapt(provider, False)
+            raise
+        self.stats.record(started, time.monotonic() - started, code)
+        if limiter is not None:
+            self._adapt(provider, not is_transient_status(code))
+        return code, info
+
+    def _hedged(self, jav_id):
+        """按提供方顺序对冲查询，返回第一个有效结果；都无效时按提供方顺序返回第一个非异常结果"""
+        if self.hedge_executor is None:
+            return self._call(self.providers[0], jav_id)
+        remaining = deque(self.providers)
+        running = {}
+        # 尚在等待令牌的请求 -> 其发出时刻的 Future；已发出的请求 -> 发出时刻
+        sending = {}
+        sent_at = {}
+        results = {}
+
+        def launch():
+            provider = remaining.popleft()
+            sent = Future()
+            future = self.hedge_executor.submit(self._call, provider, jav_id, sent)
+            running[future] = provider
+            sending[future] = sent
+
+        launch()
+        while running:
+            timeout = None
+            if remaining and not sending:
+                # 延迟预算从最近一次真正发出请求时算起
+                timeout = max(0.0, max(sent_at.values()) + self.hedge_after - time.monotonic())
+            done, _ = wait(list(running) + list(sending.values()), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # 在途请求均已发出且超出延迟预算，并发查询下一个提供方
+                self.stats.record_hedge()
+                launch()
+                continue
+            for future, sent in list(sending.items()):
+                if sent.done():
+                    sent_at[future] = sent.result()
+                    del sending[future]
+            for future in done:
+                if future not in running:
+                    continue
+                provider = running.pop(future)
+                sending.pop(future, None)
+                sent_at.pop(future, None)
+                try:
+                    code, info = future.result()
+                except Exception as e:
+                    results[provider] = e
+                    continue
+                if is_valid_result(code, info):
+                    self.stats.record_win(provider.name)
+                    return code, info
+                results[provider] = (code, info)
+            if not running and remaining:
+                # 已返回的结果都无效，立即改查下一个提供方
+                launch()
+        outcomes = [results[provider] for provider in self.providers if provider in results]
+        for outcome in outcomes:
+            if not isinstance(outcome, Exception):
+                return outcome
+        raise outcomes[0]
+
+    def _fetch(self, jav_id):
+        attempt = 0
+        while True:
+            try:
+                code, info = self._hedged(jav_id)
+            except Exception:
+                if attempt >= self.retries:
+                    raise
+            else:
+                if not is_transient_status(code) or attempt >= self.retries:
+                    return code, info
+            attempt += 1
+            self.stats.record_retry()
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+    def submit(self, jav_id):
+        """提交一次远程查询，返回结果为 (code, info) 的 Future"""
+        return self.executor.submit(self._fetch, jav_id)
+
+    def report(self):
+        """输出请求次数、状态码分布、延迟分位数和有效请求速率"""
+        stats = self.stats
+        print(f"远程请求: {stats.count} 次（重试 {stats.retries} 次）")
+        if not stats.count:
+            return
+        statuses = ', '.join(f"{'异常' if status is None else status}×{n}"
+                             for status, n in sorted(stats.statuses.items(), key=lambda item: -item[1]))
+        print(f"状态码分布: {statuses}")
+        p50, p95, p99 = (stats.percentile(q) for q in (50, 95, 99))
+        print(f"请求延迟: p50 {p50:.2f}s / p95 {p95:.2f}s / p99 {p99:.2f}s")
+        rate = stats.effective_rate()
+        if rate is not None:
+            limits = ', '.join(f"{provider.name} {limiter.rate:.3f}" for provider, limiter in self.limiters.items())
+            print(f"有效请求速率: {rate:.3f} 次/秒（当前限速 {limits or '无'} 次/秒）")
+        if self.hedge_executor is not None:
+            wins = ', '.join(f"{name}×{n}" for name, n in sorted(stats.wins.items(), key=lambda item: -item[1]))
+            print(f"对冲请求: {stats.hedges} 次，有效结果来源: {wins or '无'}")
+
+    def shutdown(self):
+        # 先标记关闭：取消在途查询时触发的完成回调据此不再补发
+        self.closed = True
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        if self.hedge_executor is not None:
+            self.hedge_executor.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        """停止查询线程并关闭各提供方的限速器"""
+        self.shutdown()
+        for limiter in self.limiters.values():
+            limiter.close()
+
+class PrefetchWindow:
+    """有界预取窗口：远程查询按番号首次出现的顺序排队，最多同时有 depth 个查询在途
+
+    查询一完成就让出名额、补发后续番号，完成的结果保留到被 result() 取走为止；
+    处理当前番号时，后续番号的查询已在途，网络等待与扫描、生成计划和输出重叠；
+    请求速率仍由 LookupEngine 的令牌桶控制。
+    完成回调只在锁内认领要补发的番号，提交放在锁外；查询被取消或引擎已关闭时不再补发，
+    避免在 ThreadPoolExecutor.shutdown(cancel_futures=True) 触发的回调中提交而死锁。
+    """
+
+    def __init__(self, engine, depth=DEFAULT_LOOKAHEAD):
+        self.engine = engine
+        self.depth = max(1, depth)
+        self.queue = deque()
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def _claim(self):
+        """在锁内从队首认领可以补发的番号，调用方在锁外对其调用 _launch()"""
+        claimed = []
+        while self.queue and self.in_flight < self.depth:
+            claimed.append(self.queue.popleft())
+            self.in_flight += 1
+        return claimed
+
+    def _launch(self, slots):
+        for slot in slots:
+            try:
+                future = self.engine.submit(slot['jav_id'])
+            except RuntimeError as e:
+                # 引擎已关闭，不能再提交新查询
+                future = Future()
+                future.set_exception(e)
+            slot['future'] = future
+            slot['submitted'].set()
+            future.add_done_callback(self._release)
+
+    def _release(self, future):
+        with self.lock:
+            self.in_flight -= 1
+            if future.cancelled() or self.engine.closed:
+                return
+            claimed = self._claim()
+        self._launch(claimed)
+
+    def enqueue(self, jav_id):
+        """排队一个番号的远程查询，返回供 result() 使用的句柄"""
+        slot = {'jav_id': jav_id, 'future': None, 'submitted': threading.Event()}
+        with self.lock:
+            self.queue.append(slot)
+            claimed = self._claim()
+        self._launch(claimed)
+        return slot
+
+    def result(self, slot):
+        """等待并返回 (code, info)；必须按 enqueue 的顺序取结果"""
+        with self.lock:
+            claimed = self._claim()
+            if slot in self.queue:
+                # 前一个查询的完成回调可能尚未执行，直接提交当前番号，不等名额
+                self.queue.remove(slot)
+                self.in_flight += 1
+                claimed.append(slot)
+        self._launch(claimed)
+        slot['submitted'].wait()
+        return slot['future'].result()
+
+class MetadataResolver:
+    """按 检查点 -> 缓存 -> 离线索引 -> 负缓存 -> 远程 的顺序解析番号
+
+    begin() 只做本地查找，需要远程查询时交给预取窗口排队；finish() 必须按 begin() 的顺序调用，
+    取回远程结果并写入缓存、负缓存和检查点。整个进程共用一个实例时，缓存连接和查询线程（及其 jvav 客户端）保持常驻。
+    提供 prefixes 时，前缀未知的低置信度番号不立即查询：标记为 deferred，由调用方在最后通过 resume() 补查；
+    skip_implausible 时标记为 implausible，直接走本地优化，不占用远程请求。
+    """
+
+    def __init__(self, cache, engine, index=None, checkpoint=None, refresh=False, offline=False,
+                 lookahead=DEFAULT_LOOKAHEAD, prefixes=None, skip_implausible=False, events=None):
+        self.events = events
+        self.cache = cache
+        self.engine = engine
+        self.index = index
+        self.checkpoint = checkpoint
+        self.refresh = refresh
+        self.offline = offline
+        self.prefixes = prefixes
+        self.skip_implausible = skip_implausible
+        self.prefetch = PrefetchWindow(engine, lookahead)
+        self.deferred = 0
+        self.implausible = 0
+
+    def begin(self, jav_id, rule='standard'):
+        """返回解析记录：{jav_id, source, info, miss, error, slot}
+
+        source 为 checkpoint/cache/index/negative/offline/deferred/implausible/remote。
+        """
+        resolution = {'jav_id': jav_id, 'source': None, 'info': None, 'miss': None, 'error': None, 'slot': None,
+                      'started': time.monotonic()}
+        if self.checkpoint is not None and jav_id in self.checkpoint:
+            resolution.update(source='checkpoint', info=self.checkpoint.get(jav_id))
+            return resolution
+        info = None if self.refresh else self.cache.get(jav_id)
+        indexed = self.index.get(jav_id) if info is None and self.index is not None else None
+        miss = None if self.refresh or info is not None or indexed is not None else self.cache.get_miss(jav_id)
+        if info is not None:
+            resolution.update(source='cache', info=info)
+        elif indexed is not None:
+            resolution.update(source='index', info=indexed)
+        elif miss is not None:
+            # 已知远程查不到且仍在重试等待期内，直接走本地优化
+            resolution.update(source='negative', miss=miss)
+        elif self.offline:
+            resolution['source'] = 'offline'
+        elif self.prefixes is not None and not self.prefixes.is_plausible(jav_id, rule):
+            if self.skip_implausible:
+                self.implausible += 1
+                resolution['source'] = 'implausible'
+            else:
+                self.deferred += 1
+                resolution['source'] = 'deferred'
+        else:
+            resolution.update(source='remote', slot=self.prefetch.enqueue(jav_id))
+        return resolution
+
+    def resume(self, resolution):
+        """为延后的低置信度番号发出远程查询"""
+        resolution.update(source='remote', slot=self.prefetch.enqueue(resolution['jav_id']), started=time.monotonic())
+        return resolution
+
+    def finish(self, resolution):
+        """等待远程结果（如有），更新缓存与检查点；查询异常记入 resolution['error']"""
+        jav_id = resolution['jav_id']
+        transient = False
+        code = None
+        slot = resolution.pop('slot', None)
+        if slot is not None:
+            try:
+                code, info = self.prefetch.result(slot)
+                if code == 200 and info and info.get('title'):
+                    self.cache.put(jav_id, info)
+                    resolution['info'] = info
+                    if self.prefixes is not None:
+                        self.prefixes.learn(jav_id)
+                else:
+                    transient = is_transient_status(code)
+                    if not transient:
+                        self.cache.put_miss(jav_id, code)
+            except Exception as e:
+                resolution['error'] = e
+        if self.events is not None:
+            # 远程查询的耗时从排队算起，包含限速和预取等待
+            elapsed = round(time.monotonic() - resolution['started'], 6)
+            if resolution['error'] is not None:
+                self.events.emit('error', jav_id=jav_id, message=str(resolution['error']), elapsed=elapsed)
+            elif slot is not None:
+                self.events.emit('fetched', jav_id=jav_id, status=code, found=resolution['info'] is not None,
+                                 elapsed=elapsed)
+            elif resolution['source'] in ('checkpoint', 'cache', 'index', 'negative'):
+                self.events.emit('cache-hit', jav_id=jav_id, source=resolution['source'], elapsed=elapsed)
+        if (self.checkpoint is not None and resolution['error'] is None and not transient
+                and resolution['source'] not in ('checkpoint', 'offline', 'implausible')):
+            self.checkpoint.record(jav_id, resolution['info'])
+        return resolution
+
+    def close(self):
+        """关闭解析器持有的查询线程、限速器、离线索引和缓存（由 open_resolver 创建时使用）"""
+        self.engine.close()
+        if self.index is not None:
+            self.index.close()
+        self.cache.close()
+
+# --- 增量扫描状态 ---
+
+# 文件未变化时可直接跳过的决策：无番号、已是规范命名
+FINAL_DECISIONS = {'no-id', 'canonical'}
+
+def stat_signature(st):
+    """文件身份与内容签名：(设备号, inode, 大小, mtime 纳秒)"""
+    return [st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns]
+
+class ScanState:
+    """持久化扫描状态：记录每个文件的 (设备号, inode, 大小, mtime, 上次决策) 以及每个目录的 mtime
+
+    重新运行时，签名未变且上次决策为最终决策的文件直接跳过；目录 mtime 未变且其中所有文件都已是
+    最终决策时，连目录本身都不再列出，只按记录的子目录继续向下。
+    目录 mtime 取列出之前的值，列出期间及之后新建的文件会使下次运行重新列出该目录；
+    本次有文件被重命名的目录不标记为可跳过，下次运行再列出一遍确认。
+    recheck 时已规范命名的文件不再视为最终决策，目录也都重新列出，以便重新校验。
+    """
+
+    def __init__(self, path=DEFAULT_SCAN_STATE_PATH, full_rescan=False, recheck=False):
+        self.path = path
+        # full_rescan 时不读取已有状态，但照常写入本次结果
+        self.full_rescan = full_rescan
+        self.recheck = recheck
+        self.skippable_decisions = FINAL_DECISIONS - {'canonical'} if recheck else FINAL_DECISIONS
+        self.visited_dirs = {}
+        self.decisions = {}
+        self.renamed_dirs = set()
+        self.skipped_files = 0
+        self.skipped_dirs = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " path TEXT PRIMARY KEY,"
+            " dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER,"
+            " decision TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            " path TEXT PRIMARY KEY,"
+            " mtime_ns INTEGER NOT NULL,"
+            " subdirs TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def dir_record(self, path):
+        """返回已全部处理完毕的目录的 (mtime 纳秒, 子目录名列表)，无记录返回 None"""
+        if self.full_rescan or self.recheck:
+            return None
+        row = self.conn.execute("SELECT mtime_ns, subdirs FROM dirs WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def unchanged_file(self, path, signature):
+        """文件签名未变且上次已得出最终决策时返回 True"""
+        if self.full_rescan:
+            return False
+        row = self.conn.execute(
+            "SELECT dev, ino, size, mtime_ns, decision FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None or list(row[:4]) != signature or row[4] not in self.skippable_decisions:
+            return False
+        self.skipped_files += 1
+        return True
+
+    def visit_dir(self, path, mtime_ns, subdirs):
+        """记录本次完整列出的目录及列出前读取的 mtime，运行结束时在 finish() 中落盘"""
+        self.visited_dirs[path] = (mtime_ns, subdirs)
+
+    def record_file(self, path, signature, decision):
+        """记录文件的最新决策；非最终决策会使所在目录下次仍需完整扫描"""
+        self.conn.execute(
+            "INSERT OR REPLACE INTO files (path, dev, ino, size, mtime_ns, decision) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, *signature, decision),
+        )
+        self.decisions[path] = decision
+
+    def forget_file(self, path):
+        self.conn.execute("DELETE FROM files WHERE path = ?", (path,))
+        self.decisions.pop(path, None)
+
+    def record_rename(self, source, target, signature):
+        """文件已重命名为规范名称；所在目录的 mtime 随之改变，本次不再标记为可跳过"""
+        self.forget_file(source)
+        self.record_file(target, signature, 'canonical')
+        self.renamed_dirs.update((os.path.dirname(source), os.path.dirname(target)))
+
+    def finish(self):
+        """只把全部处理完毕、且本次没有发生重命名的目录连同列出前的 mtime 标记为可跳过"""
+        unsettled_dirs = {os.path.dirname(path) for path, decision in self.decisions.items()
+                          if decision not in FINAL_DECISIONS}
+        unsettled_dirs |= self.renamed_dirs
+        for path in self.renamed_dirs:
+            self.conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+        for path, (mtime_ns, subdirs) in self.visited_dirs.items():
+            if path in unsettled_dirs:
+                self.conn.execute("DELETE FROM dirs WHERE path = ?", (path,))
+                continue
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dirs (path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+                (path, mtime_ns, json.dumps(subdirs, ensure_ascii=False)),
+            )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+# --- 运行状态（扫描清单 / 解析检查点 / 重命名计划） ---
+
+def default_work_dir(target_directory):
+    """根据目标目录的绝对路径生成独立的工作目录"""
+    digest = hashlib.sha1(os.path.abspath(target_directory).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(DEFAULT_WORK_ROOT, digest)
+
+def default_journal_path(work_dir):
+    """每次执行生成一个带时间戳的重命名日志"""
+    return os.path.join(work_dir, time.strftime('journal-%Y%m%d-%H%M%S.jsonl'))
+
+def write_jsonl(path, records):
+    """先写临时文件再原子替换，保证文件存在即完整"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+def read_jsonl(path):
+    """逐行读取 JSONL，忽略中断时可能残留的不完整行"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+class EventLog:
+    """结构化事件流：每个决策写一行 JSON（ts、event 及相关字段），经大缓冲区批量写入，不逐行刷盘
+
+    事件：scanned、extracted、cache-hit、fetched、planned、renamed、skipped（附 reason）、error（附 message）。
+    只在调用方线程中写入。
+    """
+
+    def __init__(self, path, buffer_size=EVENT_BUFFER_SIZE):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8', buffering=buffer_size)
+        self.count = 0
+
+    def emit(self, event, **fields):
+        self.file.write(json.dumps({'ts': round(time.time(), 3), 'event': event, **fields},
+                                   ensure_ascii=False, default=str) + '\n')
+        self.count += 1
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class ProgressBar:
+    """安静模式下的单行进度条（写到 stderr）：完成数、百分比、速率和预计剩余时间；total 为 None 时只显示计数和速率"""
+
+    def __init__(self, label, total=None, stream=None):
+        self.label = label
+        self.total = total
+        self.stream = stream or sys.stderr
+        self.done = 0
+        self.started = time.monotonic()
+        self.drawn = 0.0
+
+    def advance(self, n=1):
+        self.done += n
+        now = time.monotonic()
+        if now - self.drawn >= PROGRESS_REFRESH_SECONDS:
+            self.drawn = now
+            self._draw(now)
+
+    def _draw(self, now):
+        elapsed = now - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        if self.total:
+            fraction = min(1.0, self.done / self.total)
+            filled = int(fraction * 24)
+            line = f"{self.label}: [{'#' * filled}{'-' * (24 - filled)}] {self.done}/{self.total} {fraction:.1%} | {rate:.1f} 个/秒"
+            if rate > 0 and self.done < self.total:
+                remaining = int((self.total - self.done) / rate)
+                line += f" | 剩余 {remaining // 3600:02d}:{remaining // 60 % 60:02d}:{remaining % 60:02d}"
+        else:
+            line = f"{self.label}: {self.done} 个 | {rate:.1f} 个/秒"
+        self.stream.write('\r' + line + '\033[K')
+        self.stream.flush()
+
+    def close(self):
+        self._draw(time.monotonic())
+        self.stream.write('\n')
+        self.stream.flush()
+
+class ResolveCheckpoint:
+    """解析阶段检查点：每解析完一个番号追加一行，重新运行时据此跳过已解析的番号"""
+
+    def __init__(self, path):
+        self.path = path
+        self.resolved = {}
+        if os.path.exists(path):
+            for record in read_jsonl(path):
+                self.resolved[record['jav_id']] = record.get('info')
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def __contains__(self, jav_id):
+        return jav_id in self.resolved
+
+    def get(self, jav_id):
+        return self.resolved.get(jav_id)
+
+    def record(self, jav_id, info):
+        """记录一个番号的解析结果，info 为 None 表示远程未找到"""
+        if info is not None:
+            info = {'title': info['title'], 'stars': info.get('stars') or []}
+        self.resolved[jav_id] = info
+        self.file.write(json.dumps({'jav_id': jav_id, 'info': info}, ensure_ascii=False, default=str) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+# --- 番号识别 ---
+
+# 番号识别规则注册表：(规则名, 预编译正则, 规范化函数, 基础分, 必含关键字)。
+# 所有规则都会在文件名上匹配，候选番号按 基础分 + 上下文得分 排序，同分时越靠后的匹配越优先；
+# 设置了必含关键字的规则在小写文件名不含该关键字时直接跳过，省去一次正则扫描
+ID_PATTERNS = []
+
+# 编码/规格标记（如 HEVC10、AAC20、10bit），前缀命中即丢弃
+SPEC_ID_PREFIXES = {'HEVC', 'AVC', 'AAC', 'FLAC', 'DTS', 'FPS', 'BIT', 'HDR'}
+# 视频编码标记（如 x264、H-265）
+CODEC_ID_TOKENS = {('X', '264'), ('X', '265'), ('H', '264'), ('H', '265')}
+# 分卷/分集标记（如 CD01、EP12、PART02），仅当数字不超过两位时丢弃
+VOLUME_ID_PREFIXES = {'CD', 'DISC', 'DISK', 'PART', 'PT', 'EP', 'VOL', 'S', 'E'}
+
+# 紧跟在匹配之后出现时，说明匹配到的是网站域名的一部分（如 hhd800.com@ZRK-002）
+DOMAIN_SUFFIX_PATTERN = re.compile(r'\.(?:com|net|org|cc|tv|me|xyz|info|top|la)\b|@', re.IGNORECASE)
+
+def register_id_pattern(name, pattern, normalize, score, hint=None):
+    """注册一条番号识别规则，normalize 接收 re.Match 并返回规范化后的番号"""
+    ID_PATTERNS.append((name, re.compile(pattern, re.IGNORECASE), normalize, score, hint))
+
+def normalize_standard_id(match):
+    """标准番号 ABC-123：字母转大写；数字原始位数 >= 4 去前导0，<= 3 左侧补足为3位"""
+    raw = match.group(2)
+    stripped = raw.lstrip('0')
+    if len(raw) >= 4:
+        num = stripped or '0'
+    else:
+        num = (stripped or '0').zfill(3)
+    return f"{match.group(1).upper()}-{num}"
+
+register_id_pattern('fc2', r'(?<![A-Za-z0-9])FC2[-_ ]?(?:PPV[-_ ]?)?(\d{5,8})(?!\d)',
+                    lambda m: f"FC2-PPV-{m.group(1)}", 100, hint='fc2')
+register_id_pattern('heyzo', r'(?<![A-Za-z0-9])HEYZO[-_ ]?(\d{3,5})(?!\d)',
+                    lambda m: f"HEYZO-{m.group(1).zfill(4)}", 90, hint='heyzo')
+# Caribbeancom（123456-789）、一本道 / 10musume（123456_789、123456_01）等日期式番号，保留原分隔符
+register_id_pattern('date-serial', r'(?<![\dA-Za-z])(\d{6})([-_])(\d{2,3})(?![\d])',
+                    lambda m: f"{m.group(1)}{m.group(2)}{m.group(3)}", 80)
+# 匹配大多数标准和非标准番号 (例如: ABC-123, ab-123, abc123)，支持下划线、空格、连字符等分隔符
+register_id_pattern('standard', r'(?<![A-Za-z])([A-Za-z]{1,6})[-_ ]?(\d{2,6})(?!\d)',
+                    normalize_standard_id, 50)
+
+def score_id_match(filename, match, base_score):
+    """根据匹配上下文给候选番号打分，返回 0 表示丢弃"""
+    if DOMAIN_SUFFIX_PATTERN.match(filename, match.end()):
+        return 0
+    prefix = match.group(1).upper()
+    digits = match.group(match.lastindex)
+    if (prefix in SPEC_ID_PREFIXES or (prefix, digits) in CODEC_ID_TOKENS
+            or (prefix in VOLUME_ID_PREFIXES and len(digits) <= 2)):
+        return 0
+    score = base_score
+    # 带分隔符的写法更可能是真正的番号
+    if re.search(r'[-_]', match.group(0)):
+        score += 10
+    # 单字母前缀多为编码/分辨率等误判（如 x264）
+    if prefix.isalpha() and len(prefix) == 1:
+        score -= 30
+    return max(score, 0)
+
+def extract_id_candidates(filename):
+    """返回文件名中的所有候选番号 [(得分, 番号, 规则名)]，按优先级从高到低排序"""
+    scored = []
+    lowered = filename.lower()
+    for name, regex, normalize, base_score, hint in ID_PATTERNS:
+        if hint is not None and hint not in lowered:
+            continue
+        for match in regex.finditer(filename):
+            score = score_id_match(filename, match, base_score)
+            if score > 0:
+                scored.append((score, match.end(), normalize(match), name))
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [(score, jav_id, name) for score, _, jav_id, name in scored]
+
+def extract_id_from_filename(filename):
+    """从文件名中提取 JAV 番号，返回得分最高的候选，无候选返回 None"""
+    candidates = extract_id_candidates(filename)
+    return candidates[0][1] if candidates else None
+
+STANDARD_ID_PATTERN = re.compile(r'^([A-Z]{1,6})-\d+$')
+
+class PrefixIndex:
+    """已知厂牌前缀索引，用于在远程查询前判断候选番号是否可信
+
+    前缀来自附带的种子列表、本次运行中解析成功的番号，以及元数据缓存 / 离线索引中已有的番号
+    （后两者按需做主键范围查询并记住结果，不预先加载）。只有标准规则识别出的番号需要核对前缀，
+    FC2、HEYZO、日期式番号由专用规则识别，本身即可信。
+    """
+
+    def __init__(self, sources=(), seed_path=None):
+        self.sources = [source for source in sources if source is not None]
+        self.known = {}
+        if seed_path and os.path.exists(seed_path):
+            with open(seed_path, encoding='utf-8') as f:
+                for line in f:
+                    for prefix in line.split('#', 1)[0].upper().split():
+                        self.known[prefix] = True
+
+    def learn(self, jav_id):
+        """记录一个解析成功的番号的前缀"""
+        match = STANDARD_ID_PATTERN.match(jav_id)
+        if match:
+            self.known[match.group(1)] = True
+
+    def is_known(self, prefix):
+        known = self.known.get(prefix)
+        if known is None:
+            known = self.known[prefix] = any(source.has_prefix(prefix) for source in self.sources)
+        return known
+
+    def is_plausible(self, jav_id, rule='standard'):
+        """番号由专用规则识别、或其前缀曾解析成功时视为可信"""
+        if rule != 'standard':
+            return True
+        match = STANDARD_ID_PATTERN.match(jav_id)
+        return match is None or self.is_known(match.group(1))
+
+def extract_ids(names):
+    """批量提取番号，返回与输入一一对应的列表（无番号的位置为 None）"""
+    extract = extract_id_from_filename
+    return [extract(name) for name in names]
+
+def benchmark_extractor(count=100000, seed=0):
+    """用合成文件名对比新旧番号提取的速度与准确率"""
+    import random
+
+    def legacy_extract(filename):
+        # 旧实现：通用正则 findall 后取最后一个匹配
+        matches = re.findall(r'([A-Za-z]{1,6})[-_ ]?(\d{2,6})', filename, re.IGNORECASE)
+        if not matches:
+            return None
+        prefix, raw = matches[-1]
+        stripped = raw.lstrip('0')
+        num = (stripped or '0') if len(raw) >= 4 else (stripped or '0').zfill(3)
+        return f"{prefix.upper()}-{num}"
+
+    rng = random.Random(seed)
+    letters = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    noise_before = ['', '', 'hhd800.com@', '[FHD] ', 'www.example.com@']
+    noise_after = ['', '', ' 1080p', ' x264', ' H-264 AAC', ' FHD', ' 4K']
+    names = []
+    expected = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.1:
+            num = str(rng.randint(100000, 4999999))
+            jav_id, core = f"FC2-PPV-{num}", f"FC2-PPV-{num}"
+        elif kind < 0.15:
+            num = f"{rng.randint(1, 3000):04d}"
+            jav_id, core = f"HEYZO-{num}", f"heyzo_{num}"
+        elif kind < 0.25:
+            core = f"{rng.randint(10, 12):02d}{rng.randint(1, 28):02d}{rng.randint(10, 24):02d}-{rng.randint(1, 999):03d}"
+            jav_id = core
+        else:
+            prefix = ''.join(rng.choice(letters) for _ in range(rng.randint(2, 5)))
+            num = rng.randint(1, 999)
+            jav_id, core = f"{prefix}-{num:03d}", f"{prefix.lower()}-{num:03d}"
+        names.append(f"{rng.choice(noise_before)}{core}{rng.choice(noise_after)}.mp4")
+        expected.append(jav_id)
+
+    for label, extract in (('旧实现 (单一正则)', lambda batch: [legacy_extract(n) for n in batch]),
+                           ('规则注册表', extract_ids)):
+        start = time.perf_counter()
+        results = extract(names)
+        elapsed = time.perf_counter() - start
+        correct = sum(1 for got, want in zip(results, expected) if got == want)
+        print(f"{label}: {count} 个文件名耗时 {elapsed:.3f}s ({count / elapsed:,.0f} 个/秒)，"
+              f"正确 {correct / count:.2%}，误识别 {count - correct} 个")
+
+# --- 重命名计划与执行 ---
+
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1   # Linux renameat2
+RENAME_EXCL = 0x4      # macOS renamex_np
+
+def _load_libc_rename():
+    """查找 libc 中支持"不覆盖"语义的原子重命名函数，返回 (名称, 函数) 或 (None, None)"""
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+    except OSError:
+        return None, None
+    for name, argtypes in (('renameat2', [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]),
+                           ('renamex_np', [ctypes.c_char_p, ctypes.c_char_p, ctypes.c_uint])):
+        func = getattr(libc, name, None)
+        if func is not None:
+            func.argtypes = argtypes
+            func.restype = ctypes.c_int
+            return name, func
+    return None, None
+
+LIBC_RENAME_NAME, LIBC_RENAME = _load_libc_rename()
+
+def rename_noreplace(source, target):
+    """原子重命名且绝不覆盖已存在的目标：目标存在时抛出 FileExistsError，源不存在时抛出 FileNotFoundError
+
+    Linux 使用 renameat2(RENAME_NOREPLACE)，macOS 使用 renamex_np(RENAME_EXCL)，一次系统调用、无竞争窗口；
+    系统或文件系统不支持时退回"先检查再 os.rename"。
+    """
+    if LIBC_RENAME is not None:
+        src, dst = os.fsencode(source), os.fsencode(target)
+        if LIBC_RENAME_NAME == 'renameat2':
+            result = LIBC_RENAME(AT_FDCWD, src, AT_FDCWD, dst, RENAME_NOREPLACE)
+        else:
+            result = LIBC_RENAME(src, dst, RENAME_EXCL)
+        if result == 0:
+            return
+        err = ctypes.get_errno()
+        # 内核或文件系统不支持该标志时退回普通重命名
+        if err not in (errno.ENOSYS, errno.EINVAL, errno.ENOTSUP):
+            raise OSError(err, os.strerror(err), source, None, target)
+    if os.path.lexists(target):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), source, None, target)
+    os.rename(source, target)
+
+def is_same_file(source, target):
+    """两个路径是否指向同一个文件（同一设备上的同一 inode）；任一路径不存在时返回 False"""
+    try:
+        return os.path.samefile(source, target)
+    except OSError:
+        return False
+
+def path_collision_key(path):
+    """冲突检查用的路径键：统一 Unicode 规范形式并忽略大小写，兼容 macOS / SMB 等大小写不敏感的卷"""
+    return unicodedata.normalize('NFC', path).casefold()
+
+def split_plan_conflicts(plan):
+    """在内存中一次性检查整个计划（O(n) 哈希表），返回 (可执行条目, 冲突条目)
+
+    多个源文件映射到同一目标（忽略大小写）时，这些条目全部视为冲突，都不执行。
+    """
+    claims = {}
+    keys = []
+    for entry in plan:
+        key = path_collision_key(entry['target'])
+        keys.append(key)
+        claims[key] = claims.get(key, 0) + 1
+    accepted = []
+    conflicts = []
+    for entry, key in zip(plan, keys):
+        (conflicts if claims[key] > 1 else accepted).append(entry)
+    return accepted, conflicts
+
+def report_plan_conflicts(conflicts, scan_state=None, events=None):
+    """输出计划内的目标冲突，返回冲突条目数"""
+    by_target = {}
+    for entry in conflicts:
+        by_target.setdefault(path_collision_key(entry['target']), []).append(entry)
+    for entries in by_target.values():
+        print(f"[冲突] {len(entries)} 个文件将被重命名为同一目标（忽略大小写）: {entries[0]['target']}")
+        for entry in entries:
+            print(f" ├─ {entry['source']}")
+            if scan_state is not None and entry.get('stat'):
+                scan_state.record_file(entry['source'], entry['stat'], 'error')
+            if events is not None:
+                events.emit('skipped', path=entry['source'], target=entry['target'], reason='conflict')
+        print(" └─ 操作: 为避免覆盖，以上文件均已跳过.\n")
+    return len(conflicts)
+
+class RenameJournal:
+    """重命名日志：每次成功的重命名追加一行 (旧路径, 新路径, 设备号, inode, 时间戳)
+
+    每行写入后立即 flush 到操作系统，进程崩溃也不会丢失；只有 fsync（防断电）按批进行。
+    """
+
+    def __init__(self, path, fsync_every=JOURNAL_FSYNC_BATCH):
+        self.path = path
+        self.fsync_every = max(1, fsync_every)
+        self.unsynced = 0
+        self.count = 0
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def record(self, old_path, new_path, signature):
+        self.file.write(json.dumps({
+            'old': old_path,
+            'new': new_path,
+            'dev': signature[0],
+            'ino': signature[1],
+            'ts': time.time(),
+        }, ensure_ascii=False) + '\n')
+        self.file.flush()
+        self.count += 1
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+def undo_renames(journal_path, dry_run, force=False):
+    """按日志倒序一次性撤销整批重命名，不做任何元数据查询，返回 (撤销数, 失败数)
+
+    先核对全部条目：新路径上文件的设备号和 inode 须与日志一致，防止误移动后来出现的同名文件。
+    有条目不一致或文件缺失时先列出这些条目；除非 force，否则整批不做任何移动，避免只撤销一半。
+    """
+    entries = list(read_jsonl(journal_path))
+    pending = []
+    problems = []
+    already_count = 0
+    for entry in reversed(entries):
+        old_path, new_path = entry['old'], entry['new']
+        try:
+            st = os.lstat(new_path)
+        except FileNotFoundError:
+            if os.path.lexists(old_path):
+                already_count += 1
+            else:
+                problems.append((entry, "文件不存在"))
+            continue
+        if (st.st_dev, st.st_ino) != (entry['dev'], entry['ino']):
+            problems.append((entry, "inode 与日志不一致，文件可能已被替换"))
+            continue
+        pending.append(entry)
+
+    if already_count:
+        print(f"已是原文件名，跳过: {already_count} 个\n")
+    for entry, reason in problems:
+        print(f"[核对失败] {entry['new']}")
+        print(f" └─ 原因: {reason}\n")
+    if problems and not force:
+        print(f"有 {len(problems)} 个条目核对失败，未撤销任何文件；确认后可加 --undo-force 跳过这些条目撤销其余文件。\n")
+        return 0, len(problems)
+
+    undone_count = 0
+    failed_count = len(problems)
+    for entry in pending:
+        old_path, new_path = entry['old'], entry['new']
+        print(f"[撤销] {new_path}")
+        print(f" ├─ 恢复为: {os.path.basename(old_path)}")
+        if dry_run:
+            print(" └─ 操作: 预览，未执行\n")
+            undone_count += 1
+            continue
+        try:
+            rename_noreplace(new_path, old_path)
+        except OSError as e:
+            print(f" └─ 操作: 失败 - {e}\n")
+            failed_count += 1
+            continue
+        print(" └─ 操作: 撤销成功！\n")
+        undone_count += 1
+    return undone_count, failed_count
+
+# 单个重命名条目的执行结果中计为失败的结果
+FAILED_OUTCOMES = {'missing', 'exists', 'error'}
+
+def discard_output(*args, **kwargs):
+    """逐文件输出的空实现：库调用方未要求 verbose 时代替 print"""
+
+def apply_rename(entry, dry_run, scan_state=None, journal=None, events=None, verbose=True):
+    """执行（或预览）单个重命名条目，只发起一次不覆盖的原子重命名，返回结果：
+
+    renamed（成功）、preview（预览）、already（此前的运行中已完成）、missing（源文件不存在）、
+    exists（目标已存在）、error（其他系统错误）。verbose 为假时不输出逐文件信息。
+    """
+    say = print if verbose else discard_output
+    source, target = entry['source'], entry['target']
+    say(f"[重命名] {source}")
+    say(f" ├─ 目标: {os.path.basename(target)}")
+    if dry_run:
+        say(" └─ 操作: 预览，未执行\n")
+        return 'preview'
+    started = time.monotonic()
+    try:
+        # 大小写不敏感的卷上仅改变大小写时，目标即源文件本身，只能用普通重命名；
+        # 大小写敏感的卷上目标可能是另一个文件，必须确认是同一 inode，否则照常不覆盖
+        if path_collision_key(source) == path_collision_key(target) and is_same_file(source, target):
+            os.rename(source, target)
+        else:
+            rename_noreplace(source, target)
+    except FileNotFoundError:
+        if os.path.lexists(target):
+            say(" └─ 操作: 已在此前的运行中完成，跳过.\n")
+            if events is not None:
+                events.emit('skipped', path=source, target=target, reason='already-renamed')
+            return 'already'
+        say(" └─ 操作: 失败 - 源文件不存在，已跳过.\n")
+        if events is not None:
+            events.emit('error', path=source, target=target, message='源文件不存在')
+        return 'missing'
+    except FileExistsError:
+        say(" └─ 操作: 失败 - 目标文件名已存在，为避免覆盖，已跳过.\n")
+        if scan_state is not None and entry.get('stat'):
+            scan_state.record_file(source, entry['stat'], 'error')
+        if events is not None:
+            events.emit('skipped', path=source, target=target, reason='target-exists')
+        return 'exists'
+    except OSError as e:
+        say(f" └─ 操作: 失败 - {e}\n")
+        if scan_state is not None and entry.get('stat'):
+            scan_state.record_file(source, entry['stat'], 'error')
+        if events is not None:
+            events.emit('error', path=source, target=target, message=str(e))
+        return 'error'
+    say(" └─ 操作: 重命名成功！\n")
+    if events is not None:
+        events.emit('renamed', path=source, target=target, elapsed=round(time.monotonic() - started, 6))
+    if journal is not None:
+        journal.record(source, target, entry.get('stat') or stat_signature(os.lstat(target)))
+    if scan_state is not None and entry.get('stat'):
+        # 重命名不改变 inode、大小和 mtime，沿用扫描时的签名
+        scan_state.record_rename(source, target, entry['stat'])
+    return 'renamed'
+
+def apply_rename_plan(plan, dry_run, scan_state=None, journal=None, events=None, progress=None):
+    """按重命名计划执行（或预览）重命名，返回 (成功数, 失败数)
+
+    执行前先在内存中检查计划内的目标冲突，再逐条调用 apply_rename()。
+    源文件已不存在且目标文件已存在的条目视为此前运行中已完成，便于中断后重跑。
+    提供 scan_state 时，重命名成功的文件以新路径记为规范命名，失败的记为 error；
+    提供 journal 时，每次成功的重命名都会写入重命名日志，供 --undo 撤销。
+    """
+    plan, conflicts = split_plan_conflicts(plan)
+    failed_count = report_plan_conflicts(conflicts, scan_state, events)
+    renamed_count = 0
+    for entry in plan:
+        if progress is not None:
+            progress.advance()
+        outcome = apply_rename(entry, dry_run, scan_state, journal, events)
+        if outcome in FAILED_OUTCOMES:
+            failed_count += 1
+        elif outcome != 'already':
+            renamed_count += 1
+    return renamed_count, failed_count
+
+# --- 目录监视（inotify） ---
+
+# inotify 事件掩码（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event 的定长头部：wd, mask, cookie, len，其后紧跟 len 字节的文件名
+INOTIFY_EVENT = struct.Struct('iIII')
+INOTIFY_READ_SIZE = 64 * 1024
+
+class InotifyWatcher:
+    """通过 ctypes 调用 inotify 递归监视目录树（仅 Linux），跳过名为 no_need 的文件夹
+
+    关注写入完成（IN_CLOSE_WRITE）、移入（IN_MOVED_TO）和新建（IN_CREATE）事件；
+    新建或移入的子目录由调用方通过 add_tree() 加入监视。
+    """
+
+    def __init__(self, root):
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, "当前系统不支持 inotify，监视模式仅支持 Linux")
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._add_watch.restype = ctypes.c_int
+        self.fd = libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self.watches = {}
+        self.overflowed = 0
+        self.add_tree(root)
+
+    def add_tree(self, root):
+        """监视 root 及其所有子目录，返回其中已存在的文件路径（新目录移入时这些文件不会再产生事件）"""
+        existing = []
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name != 'no_need']
+            wd = self._add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                print(f"警告: 无法监视目录 {dirpath}: {os.strerror(ctypes.get_errno())}")
+                continue
+            self.watches[wd] = dirpath
+            existing.extend(os.path.join(dirpath, name) for name in filenames)
+        return existing
+
+    def read(self, timeout=None):
+        """最多等待 timeout 秒，返回本批事件 [(路径, 是否目录)]"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self.fd, INOTIFY_READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                self.overflowed += 1
+                continue
+            if mask & IN_IGNORED:
+                # 目录被删除或移出，内核已自动撤销监视
+                self.watches.pop(wd, None)
+                continue
+            directory = self.watches.get(wd)
+            if directory is None or not name:
+                continue
+            events.append((os.path.join(directory, os.fsdecode(name)), bool(mask & IN_ISDIR)))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+def process_new_files(files, resolver, dry_run, journal=None, own_targets=None):
+    """把一批已写入完成的新文件走完 提取番号 -> 解析 -> 重命名，返回 (成功数, 失败数)
+
+    执行模式下计划的目标路径会加入 own_targets，供监视循环忽略这些重命名自身产生的事件。
+    """
+    groups = {}
+    pending = []
+    events = resolver.events
+    for path, st in files:
+        if events is not None:
+            events.emit('scanned', path=path, size=st.st_size)
+        candidate = make_candidate(os.path.dirname(path), os.path.basename(path), stat_signature(st))
+        if candidate is None or is_canonical_filename(candidate['filename']):
+            if events is not None:
+                events.emit('skipped', path=path, reason='no-id' if candidate is None else 'canonical')
+            continue
+        if events is not None:
+            events.emit('extracted', path=path, jav_id=candidate['jav_id'], rule=candidate['rule'])
+        jav_id = candidate['jav_id']
+        group = groups.get(jav_id)
+        if group is None:
+            group = groups[jav_id] = []
+            pending.append((resolver.begin(jav_id, candidate['rule']), group))
+        group.append(candidate)
+
+    plan, error_count = resolve_groups(resolver, pending)
+    if not plan:
+        if resolver.events is not None:
+            resolver.events.flush()
+        return 0, error_count
+    if own_targets is not None and not dry_run:
+        own_targets.update(entry['target'] for entry in plan)
+    renamed_count, apply_errors = apply_rename_plan(plan, dry_run, journal=journal, events=resolver.events)
+    if journal is not None:
+        journal.sync()
+    if resolver.events is not None:
+        resolver.events.flush()
+    return renamed_count, error_count + apply_errors
+
+def watch_directory(target_directory, resolver, dry_run, journal=None, settle_seconds=DEFAULT_SETTLE_SECONDS):
+    """常驻监视目录树，只处理新写入或移入的文件，不重新扫描整棵目录树；Ctrl-C 退出，返回 (成功数, 失败数)
+
+    文件大小连续 settle_seconds 秒不变才视为写入完成，下载或复制中仍在增长的文件会一直等待。
+    本工具自己重命名产生的移入事件会被忽略。
+    """
+    watcher = InotifyWatcher(target_directory)
+    settling = {}  # 路径 -> (上次观察到的大小, 大小最后一次变化的时刻)
+    own_targets = set()
+    renamed_count = 0
+    error_count = 0
+    poll_interval = min(1.0, max(settle_seconds, 0.1))
+    print(f"开始监视目录: {target_directory}（{len(watcher.watches)} 个目录，Ctrl-C 退出）\n")
+    try:
+        while True:
+            events = watcher.read(poll_interval if settling else None)
+            now = time.monotonic()
+            for path, is_dir in events:
+                paths = watcher.add_tree(path) if is_dir else [path]
+                for path in paths:
+                    if path in own_targets:
+                        own_targets.discard(path)
+                    elif is_supported_file(os.path.basename(path)):
+                        # 每个新事件都重新开始计时
+                        settling[path] = (None, now)
+            if watcher.overflowed:
+                print(f"警告: inotify 事件队列溢出 {watcher.overflowed} 次，部分新文件可能被遗漏，可稍后完整运行一次补齐\n")
+                watcher.overflowed = 0
+
+            ready = []
+            for path, (size, since) in list(settling.items()):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # 临时文件已被删除或改名，改名后的路径会产生自己的事件
+                    del settling[path]
+                    continue
+                if st.st_size != size:
+                    settling[path] = (st.st_size, now)
+                elif now - since >= settle_seconds:
+                    del settling[path]
+                    if stat.S_ISREG(st.st_mode):
+                        ready.append((path, st))
+            if ready:
+                renamed, errors = process_new_files(ready, resolver, dry_run, journal, own_targets)
+                renamed_count += renamed
+                error_count += errors
+    except KeyboardInterrupt:
+        print("\n停止监视。")
+    finally:
+        watcher.close()
+    return renamed_count, error_count
+
+# --- 库接口 ---
+#
+# 供其他批处理任务导入使用：scan() -> resolve() -> plan() -> apply() 均为生成器，可逐级组合。
+# 每一级只保留有界的在途数据，处理任意数量的文件内存占用都保持恒定；
+# 解析器由 open_resolver() 创建一次后反复使用，缓存连接和查询线程（及其 jvav 客户端）在整个进程内常驻。
+
+def open_resolver(cache_path=None, cache_ttl_days=DEFAULT_CACHE_TTL_DAYS,
+                  miss_ttl_days=DEFAULT_MISS_TTL_DAYS, index_path=DEFAULT_INDEX_PATH,
+                  rate_limit_path=DEFAULT_RATE_LIMIT_PATH, request_rate=DEFAULT_REQUEST_RATE,
+                  request_burst=DEFAULT_REQUEST_BURST, min_request_rate=DEFAULT_MIN_REQUEST_RATE,
+                  max_request_rate=DEFAULT_MAX_REQUEST_RATE, retries=DEFAULT_LOOKUP_RETRIES,
+                  workers=DEFAULT_LOOKUP_WORKERS, lookahead=DEFAULT_LOOKAHEAD, providers=None,
+                  hedge_after=DEFAULT_HEDGE_AFTER_SECONDS, refresh=False, offline=False, events=None,
+                  check_prefixes=False, prefix_seed_path=DEFAULT_PREFIX_SEED_PATH, skip_implausible=False):
+    """创建一个持有缓存、离线索引、限速器和查询引擎的解析器，用完后调用其 close()
+
+    check_prefixes 默认关闭：开启后 resolve() 需要保留低置信度番号直到输入耗尽。
+    cache_path 为 None 时按 resolve_cache_path() 选择：含 stub 提供方的链使用内存缓存。
+    """
+    cache = MetadataCache(resolve_cache_path(cache_path, providers), cache_ttl_days, miss_ttl_days)
+    index = OfflineIndex(index_path) if index_path and os.path.exists(index_path) else None
+    engine = LookupEngine(workers, lambda name: open_rate_limiter(rate_limit_path, request_rate, request_burst, name),
+                          min_rate=min_request_rate, max_rate=max_request_rate, retries=retries,
+                          providers=providers, hedge_after=hedge_after)
+    prefixes = PrefixIndex([cache, index], prefix_seed_path) if check_prefixes else None
+    return MetadataResolver(cache, engine, index, refresh=refresh, offline=offline, lookahead=lookahead,
+                            prefixes=prefixes, skip_implausible=skip_implausible, events=events)
+
+def scan(target_directory, recheck=False, scan_state=None, workers=DEFAULT_SCAN_WORKERS, events=None):
+    """逐个产出目录树中含番号、尚未规范命名的候选文件（recheck 为真时也产出已规范命名的文件）"""
+    for candidate in scan_candidates(os.path.abspath(target_directory), scan_state, workers, events):
+        if not recheck and is_canonical_filename(candidate['filename']):
+            if scan_state is not None:
+                scan_state.record_file(os.path.join(candidate['root'], candidate['filename']),
+                                       candidate['stat'], 'canonical')
+            continue
+        yield candidate
+
+def resolve(candidates, resolver, window=None):
+    """接收候选文件的可迭代对象，按输入顺序产出 (候选, 解析记录)
+
+    最多向前读取 window 个候选（默认等于预取深度），期间的远程查询并发在途；
+    窗口内同一番号只解析一次，离开窗口后再出现的番号通常直接命中缓存。
+    解析器配置了前缀索引时，低置信度番号保留到输入耗尽后再查询。
+    """
+    window = max(1, window or resolver.prefetch.depth)
+    pending = deque()
+    active = {}
+    deferred = []
+    deferred_ids = {}
+
+    def settle():
+        candidate, resolution = pending.popleft()
+        if active.get(resolution['jav_id']) is resolution:
+            del active[resolution['jav_id']]
+            resolver.finish(resolution)
+        return candidate, resolution
+
+    for candidate in candidates:
+        jav_id = candidate['jav_id']
+        resolution = active.get(jav_id) or deferred_ids.get(jav_id)
+        if resolution is None:
+            resolution = resolver.begin(jav_id, candidate.get('rule', 'standard'))
+            if resolution['source'] == 'deferred':
+                deferred_ids[jav_id] = resolution
+            else:
+                active[jav_id] = resolution
+        if resolution['source'] == 'deferred':
+            deferred.append((candidate, resolution))
+            continue
+        pending.append((candidate, resolution))
+        while len(pending) > window:
+            yield settle()
+    while pending:
+        yield settle()
+
+    # 低置信度番号：输入耗尽后再按首次出现的顺序补查
+    for resolution in deferred_ids.values():
+        resolver.resume(resolution)
+    for candidate, resolution in deferred:
+        if deferred_ids.get(resolution['jav_id']) is resolution:
+            del deferred_ids[resolution['jav_id']]
+            resolver.finish(resolution)
+        yield candidate, resolution
+
+def plan(resolved, scan_state=None, events=None, verbose=False):
+    """接收 resolve() 的输出，逐个产出重命名计划条目（无法生成新文件名的文件不产出）
+
+    默认不向 stdout 输出逐文件信息（进度与决策可通过 events 获取）；verbose 为真时输出与命令行相同的内容。
+    """
+    for candidate, resolution in resolved:
+        entries, _ = plan_group(resolution, [candidate], scan_state, events, verbose)
+        yield from entries
+
+def apply(entries, dry_run=True, journal=None, scan_state=None, events=None, verbose=False):
+    """接收 plan() 的输出，逐条执行（或预览）重命名，产出 (计划条目, 结果)，结果含义见 apply_rename()
+
+    流式执行无法预先检查整个计划内的目标冲突，依靠不覆盖的原子重命名保证不会覆盖任何文件：
+    两个文件映射到同一目标时，后到的一个结果为 exists。默认不输出逐文件信息，verbose 为真时同命令行。
+    """
+    for entry in entries:
+        yield entry, apply_rename(entry, dry_run, scan_state, journal, events, verbose)
+
 # --- 脚本核心 ---
 
 def sanitize_filename(text):
     """移除文件名中的非法字符"""
     return re.sub(r'[\/:*?"<>|]', '-', text)
 
-def extract_id_from_filename(filename):
-    """从文件名中提取 JAV 番号"""
-    # 匹配大多数标准和非标准番号 (例如: ABC-123, ab-123, abc123)
-    # 支持下划线、空格、连字符等分隔符，字母1-6位，数字2-6位
-    # 查找所有可能的番号，优先使用最后一个（如 hhd800.com@ZRK-002.mp4）
-    matches = re.findall(r'([A-Za-z]{1,6})[-_ ]?(\d{2,6})', filename, re.IGNORECASE)
-    if matches:
-        last = matches[-1]
-        raw = last[1]
-        # 数字规范化规则：
-        # - 原始数字长度 >= 3: 清除所有前导0（不再补零）
-        # - 原始数字长度 < 3: 去前导0后左侧补零至3位
-        stripped = raw.lstrip('0')
-        # 修正规则：原始位数 >= 4 则去前导0；原始位数 <= 3 则左侧补足为3位
-        if len(raw) >= 4:
-            num = stripped or '0'
-        else:
-            num = (stripped or '0').zfill(3)
-        return f"{last[0].upper()}-{num}"
-    return None
+def detect_part_suffix(filename):
+    """检测分段标识（如 A/B/C/D 或 1/2/3/4），位置独立于番号出现形式"""
+    base_no_ext, _ = os.path.splitext(filename)
+    tokens = re.findall(r'([A-Za-z0-9]+)', base_no_ext)
+    if tokens:
+        last_token = tokens[-1]
+        if re.fullmatch(r'(?i)[A-D]|[1-4]', last_token):
+            return f' {last_token.upper()}'
+    return ''
+
+# 规范文件名：{番号} {标题}{分段标识} [{演员}]{扩展名}，演员部分可省略
+CANONICAL_NAME_PATTERN = re.compile(r'^(?P<id>\S+) (?P<title>.+?)(?P<part> [A-D1-4])?(?: \[(?P<actor>[^\[\]]+)\])?$')
+
+def is_canonical_filename(filename):
+    """判断文件名是否已是本工具生成的规范格式（纯字符串判断，不做任何 I/O）
+
+    开头必须是规范化后的番号，标题去掉方括号标签和发布标签（RELEASE_TAGS）后须含非 ASCII 字符
+    （远程标题均为日文），[演员] 后缀也不能是发布标签，以免把 "ABC-123 A.mp4"、
+    "SSIS-001 [中文字幕].mp4"、"ABC-123 HD [Uncensored].mp4" 这类原始文件名误判为已处理。
+    """
+    base_no_ext, _ = os.path.splitext(filename)
+    match = CANONICAL_NAME_PATTERN.match(base_no_ext)
+    if not match:
+        return False
+    leading_id = match.group('id')
+    if extract_id_from_filename(leading_id) != leading_id:
+        return False
+    actor = match.group('actor')
+    if actor and actor.strip().lower() in RELEASE_TAGS:
+        return False
+    title = re.sub(r'\[[^\[\]]*\]', ' ', match.group('title'))
+    words = [word for word in re.split(r'[\s_\-]+', title) if word and word.lower() not in RELEASE_TAGS]
+    return not ''.join(words).isascii()
+
+def build_new_filename(jav_id, info, filename, part_suffix):
+    """根据远程信息构建标准文件名；远程信息无效时尝试本地优化，无优化建议返回 None"""
+    base_no_ext, ext = os.path.splitext(filename)
+    if not info or not info.get('title'):
+        # 进行本地文件名优化
+        optimized_base = base_no_ext
+        for pattern in FILENAME_CLEAN_PATTERNS:
+            optimized_base = re.sub(pattern, '', optimized_base)
+        if optimized_base == base_no_ext:
+            return None
+        return f"{optimized_base}{ext}"
+
+    # 清理标题
+    raw_title = info.get('title', '')
+    # 优化：移除指定的关键词
+    for keyword in TITLE_EXCLUDE_KEYWORDS:
+        raw_title = raw_title.replace(keyword, '')
+
+    clean_title = sanitize_filename(raw_title.strip())
+    # 优化：如果标题过长，进行截断
+    if len(clean_title) > 50:
+        clean_title = clean_title[:50] + "..."
+
+    # 构建新文件名，追加分段标识
+    stars = info.get('stars') or []
+    if stars:
+        # 只取第一个演员并做非法字符清理
+        first_actor = stars[0]
+        name = first_actor.get('name') if isinstance(first_actor, dict) else str(first_actor)
+        actor_name = sanitize_filename(name)
+        # 若标题已以" 空格+演员"结尾，则不再添加方括号演员
+        if clean_title.endswith(f' {actor_name}'):
+            return f"{jav_id} {clean_title}{part_suffix}{ext}"
+        # 分段标识加在片名后、演员名前
+        return f"{jav_id} {clean_title}{part_suffix} [{actor_name}]{ext}"
+    return f"{jav_id} {clean_title}{part_suffix}{ext}"
+
+def is_supported_file(filename):
+    """跳过隐藏/系统文件（如 .DS_Store、AppleDouble 文件 ._ 开头等），只接受视频、音频、字幕"""
+    if filename.startswith('.'):
+        return False
+    _, ext = os.path.splitext(filename)
+    return bool(ext) and ext.lower() in SUPPORTED_EXTENSIONS
+
+def make_candidate(directory, filename, signature):
+    """为文件名中含番号的文件构建候选记录（含识别出番号的规则名），不含番号时返回 None"""
+    candidates = extract_id_candidates(filename)
+    if not candidates:
+        return None
+    _, jav_id, rule = candidates[0]
+    return {
+        'root': directory,
+        'filename': filename,
+        'jav_id': jav_id,
+        'rule': rule,
+        'part_suffix': detect_part_suffix(filename),
+        'stat': signature,
+    }
+
+def list_directory(directory, known=None):
+    """列出单个目录（在扫描线程池中执行），返回 (列出前的 mtime 纳秒, 子目录名列表, [(文件名, 签名)])
+
+    known 为上次记录的 (mtime 纳秒, 子目录名列表)；目录 mtime 未变时不再列出，文件部分返回 None。
+    mtime 在 scandir 之前读取，列出期间新建的文件不会被记录的 mtime 掩盖。
+    类型判断使用 DirEntry 缓存的类型信息，只对扩展名受支持的文件调用一次 stat。
+    """
+    mtime_ns = os.stat(directory).st_mtime_ns
+    if known is not None and mtime_ns == known[0]:
+        return mtime_ns, known[1], None
+    subdirs = []
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            name = entry.name
+            try:
+                # 排除名为 no_need 的文件夹，且与 os.walk 一致不跟随目录符号链接
+                if entry.is_dir(follow_symlinks=False):
+                    if name != 'no_need':
+                        subdirs.append(name)
+                    continue
+                if not is_supported_file(name):
+                    continue
+                # 跳过非普通文件
+                if not entry.is_file():
+                    continue
+                files.append((name, stat_signature(entry.stat())))
+            except OSError:
+                continue
+    return mtime_ns, subdirs, files
+
+def scan_candidates(target_directory, scan_state=None, workers=DEFAULT_SCAN_WORKERS, events=None):
+    """递归扫描目录，在线程池中并发列出子目录，每列完一个目录就立即产出其中包含番号的候选文件
+
+    产出顺序取决于各目录列出完成的先后。提供 scan_state 时，未变化的目录不再列出、未变化的文件不再处理；
+    scan_state 和 events 只在调用方线程中访问。
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='jav-scan') as executor:
+        running = {}
+
+        def submit(directory):
+            known = scan_state.dir_record(directory) if scan_state is not None else None
+            running[executor.submit(list_directory, directory, known)] = directory
+
+        submit(target_directory)
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory = running.pop(future)
+                try:
+                    mtime_ns, subdirs, files = future.result()
+                except OSError as e:
+                    print(f"警告: 无法读取目录 {directory}: {e}")
+                    continue
+                for name in subdirs:
+                    submit(os.path.join(directory, name))
+                if files is None:
+                    scan_state.skipped_dirs += 1
+                    continue
+
+                for filename, signature in files:
+                    original_path = os.path.join(directory, filename)
+                    if events is not None:
+                        events.emit('scanned', path=original_path, size=signature[2])
+                    if scan_state is not None and scan_state.unchanged_file(original_path, signature):
+                        if events is not None:
+                            events.emit('skipped', path=original_path, reason='unchanged')
+                        continue
+                    started = time.monotonic()
+                    candidate = make_candidate(directory, filename, signature)
+                    if candidate is None:
+                        if scan_state is not None:
+                            scan_state.record_file(original_path, signature, 'no-id')
+                        if events is not None:
+                            events.emit('skipped', path=original_path, reason='no-id')
+                        continue
+                    if events is not None:
+                        events.emit('extracted', path=original_path, jav_id=candidate['jav_id'],
+                                    rule=candidate['rule'], elapsed=round(time.monotonic() - started, 6))
+                    yield candidate
+                if scan_state is not None:
+                    scan_state.visit_dir(directory, mtime_ns, subdirs)
+
+def plan_group(resolution, files, scan_state=None, events=None, verbose=True):
+    """根据一个番号的解析结果为其所有文件生成重命名计划，返回 (计划条目列表, 失败数)；verbose 为假时不输出逐文件信息"""
+    say = print if verbose else discard_output
+    jav_id = resolution['jav_id']
+    source = resolution['source']
+    info = resolution['info']
+    lookup_error = resolution['error']
+    plan = []
+    error_count = 0
+    for candidate in files:
+        filename = candidate['filename']
+        original_path = os.path.join(candidate['root'], filename)
+        say(f"[处理] {filename}")
+        say(f" ├─ 提取番号: {jav_id}")
+
+        if lookup_error is not None:
+            say(f" └─ 错误: 查询 {jav_id} 时发生错误: {lookup_error}\n")
+            error_count += 1
+            if scan_state is not None:
+                scan_state.record_file(original_path, candidate['stat'], 'error')
+            if events is not None:
+                events.emit('error', path=original_path, jav_id=jav_id, message=str(lookup_error))
+            continue
+        if source == 'cache':
+            say(" ├─ 缓存命中")
+        elif source == 'index':
+            say(" ├─ 离线索引命中")
+        elif source == 'negative':
+            status, failures = resolution['miss']
+            say(f" ├─ 负缓存命中: 远程已连续 {failures} 次未找到（状态码 {status}），暂不重试")
+        elif source == 'checkpoint':
+            say(" ├─ 已从检查点恢复")
+        elif source == 'implausible':
+            say(" ├─ 番号前缀未知，可信度低，跳过远程查询")
+        if info is None:
+            say(" └─ 结果: 未找到远程信息，尝试本地优化...")
+
+        new_filename = build_new_filename(jav_id, info, filename, candidate['part_suffix'])
+        if new_filename is None:
+            say(" └─ 结果: 本地无优化建议，跳过.\n")
+            error_count += 1
+            if scan_state is not None:
+                scan_state.record_file(original_path, candidate['stat'], 'unresolved')
+            if events is not None:
+                events.emit('skipped', path=original_path, jav_id=jav_id, reason='unresolved')
+            continue
+
+        say(f" └─ 计划重命名为: {new_filename}\n")
+        if scan_state is not None:
+            scan_state.record_file(original_path, candidate['stat'], 'planned')
+        if events is not None:
+            events.emit('planned', path=original_path, jav_id=jav_id, source=source, target=new_filename)
+        plan.append({
+            'jav_id': jav_id,
+            'source': original_path,
+            'target': os.path.join(candidate['root'], new_filename),
+            'stat': candidate['stat'],
+        })
+    return plan, error_count
+
+def resolve_groups(resolver, pending, scan_state=None, progress=None):
+    """按顺序取回 [(解析记录, 文件列表)] 的解析结果并生成重命名计划，返回 (计划条目列表, 失败数)
+
+    延后的低置信度番号在其余番号全部处理完后才发出远程查询，不挤占可信番号的请求额度。
+    """
+    plan = []
+    error_count = 0
+    deferred = []
+    for resolution, files in pending:
+        if resolution['source'] == 'deferred':
+            deferred.append((resolution, files))
+            continue
+        entries, errors = plan_group(resolver.finish(resolution), files, scan_state, resolver.events)
+        plan.extend(entries)
+        error_count += errors
+        if progress is not None:
+            progress.advance(len(files))
+    if deferred:
+        print(f"--- 补查 {len(deferred)} 个前缀未知的低置信度番号 ---\n")
+        for resolution, _ in deferred:
+            resolver.resume(resolution)
+        for resolution, files in deferred:
+            entries, errors = plan_group(resolver.finish(resolution), files, scan_state, resolver.events)
+            plan.extend(entries)
+            error_count += errors
+            if progress is not None:
+                progress.advance(len(files))
+    return plan, error_count
 
 def send_completion_notification(success=True, message="JAV重命名任务已完成"):
     """发送任务完成通知"""
@@ -119,8 +2222,23 @@ def send_completion_notification(success=True, message="JAV重命名任务已完
         print(f"发送通知时发生异常: {e}")
         pass
 
-def main(dry_run, target_directory):
-    """脚本主函数"""
+def main(dry_run, target_directory, cache_path=None,
+         cache_ttl_days=DEFAULT_CACHE_TTL_DAYS, refresh=False, miss_ttl_days=DEFAULT_MISS_TTL_DAYS,
+         request_rate=DEFAULT_REQUEST_RATE, request_burst=DEFAULT_REQUEST_BURST,
+         min_request_rate=DEFAULT_MIN_REQUEST_RATE, max_request_rate=DEFAULT_MAX_REQUEST_RATE,
+         retries=DEFAULT_LOOKUP_RETRIES,
+         workers=DEFAULT_LOOKUP_WORKERS, work_dir=None, restart=False, apply_plan=None,
+         recheck=False, scan_state_path=DEFAULT_SCAN_STATE_PATH, full_rescan=False,
+         scan_workers=DEFAULT_SCAN_WORKERS, index_path=DEFAULT_INDEX_PATH, offline=False,
+         lookahead=DEFAULT_LOOKAHEAD, journal_path=None, undo=None, undo_force=False, watch=False,
+         settle_seconds=DEFAULT_SETTLE_SECONDS, rate_limit_path=DEFAULT_RATE_LIMIT_PATH,
+         prefix_seed_path=DEFAULT_PREFIX_SEED_PATH, check_prefixes=True, skip_implausible=False,
+         providers=None, hedge_after=DEFAULT_HEDGE_AFTER_SECONDS, events_path=None, progress=False):
+    """脚本主函数：扫描 -> 解析 -> 应用 三个阶段，每个阶段的结果都会落盘以便中断后恢复
+
+    提供 events_path 时把每个决策写入 JSONL 事件流；progress 为真时在 stderr 显示单行进度条（安静模式）。
+    提供方链含 stub 且未显式指定时，缓存使用内存数据库、工作目录另起一个，桩结果不会影响之后的真实运行。
+    """
     print("--- JAV 文件重命名工具 ---")
     if dry_run:
         print("**模式: 预览模式 (Dry Run)。将只显示计划的更改，不执行任何操作。**")
@@ -128,122 +2246,225 @@ def main(dry_run, target_directory):
         print("**模式: 执行模式 (Execute)。将实际重命名文件。**")
         time.sleep(3) # 在执行前给用户一个取消的机会
 
+    # 按重命名日志撤销整批重命名，不扫描也不联网
+    if undo:
+        if not os.path.isfile(undo):
+            print(f"错误: 重命名日志 '{undo}' 不存在。")
+            send_completion_notification(False, f"JAV撤销任务失败：日志文件 '{undo}' 不存在")
+            return
+        print(f"按重命名日志撤销: {undo}\n")
+        undone_count, error_count = undo_renames(undo, dry_run, undo_force)
+        print("--- 所有操作完成 ---")
+        send_completion_notification(True, f"JAV撤销完成：恢复{undone_count}个文件，{error_count}个错误")
+        return
+
+    # 直接应用此前审阅过的预览计划，不扫描也不联网
+    if apply_plan:
+        if not os.path.isfile(apply_plan):
+            print(f"错误: 重命名计划 '{apply_plan}' 不存在。")
+            send_completion_notification(False, f"JAV重命名任务失败：计划文件 '{apply_plan}' 不存在")
+            return
+        print(f"应用重命名计划: {apply_plan}\n")
+        journal = None if dry_run else RenameJournal(journal_path or default_journal_path(os.path.dirname(os.path.abspath(apply_plan))))
+        events = EventLog(events_path) if events_path else None
+        plan = list(read_jsonl(apply_plan))
+        bar = ProgressBar("重命名", len(plan)) if progress else None
+        try:
+            processed_count, error_count = apply_rename_plan(plan, dry_run, journal=journal, events=events, progress=bar)
+        finally:
+            if bar is not None:
+                bar.close()
+            if events is not None:
+                events.close()
+            if journal is not None:
+                journal.close()
+        if journal is not None:
+            print(f"重命名日志已保存: {journal.path}（可用 --undo 撤销）")
+        print("--- 所有操作完成 ---")
+        send_completion_notification(True, f"JAV重命名完成：成功处理{processed_count}个文件，{error_count}个错误")
+        return
+
     if not os.path.isdir(target_directory):
         print(f"错误: 目录 '{target_directory}' 不存在或不是一个有效的目录。")
         send_completion_notification(False, f"JAV重命名任务失败：目录 '{target_directory}' 不存在")
         return
 
-    print(f"扫描目录: {target_directory}\n")
+    cache_path = resolve_cache_path(cache_path, providers)
+    if work_dir is None:
+        work_dir = default_work_dir(target_directory)
+        if uses_stub_provider(providers):
+            work_dir += '-stub'
+    os.makedirs(work_dir, exist_ok=True)
 
-    jav_db = JavDbUtil()
+    # 监视模式：常驻进程，只处理之后新写入或移入的文件，缓存连接和查询线程在整个进程生命周期内复用
+    if watch:
+        cache = MetadataCache(cache_path, cache_ttl_days, miss_ttl_days)
+        index = OfflineIndex(index_path) if index_path and os.path.exists(index_path) else None
+        engine = LookupEngine(workers, lambda name: open_rate_limiter(rate_limit_path, request_rate, request_burst, name),
+                              min_rate=min_request_rate, max_rate=max_request_rate,
+                              retries=retries, providers=providers, hedge_after=hedge_after)
+        prefixes = PrefixIndex([cache, index], prefix_seed_path) if check_prefixes else None
+        events = EventLog(events_path) if events_path else None
+        resolver = MetadataResolver(cache, engine, index, refresh=refresh, offline=offline, lookahead=lookahead,
+                                    prefixes=prefixes, skip_implausible=skip_implausible, events=events)
+        journal = None if dry_run else RenameJournal(journal_path or default_journal_path(work_dir))
+        try:
+            processed_count, error_count = watch_directory(os.path.abspath(target_directory), resolver,
+                                                           dry_run, journal, settle_seconds)
+        except OSError as e:
+            print(f"错误: 无法监视目录: {e}")
+            send_completion_notification(False, f"JAV监视任务失败：{e}")
+            return
+        finally:
+            engine.close()
+            if journal is not None:
+                journal.close()
+            if events is not None:
+                events.close()
+            if index is not None:
+                index.close()
+            cache.close()
+        if journal is not None:
+            print(f"重命名日志已保存: {journal.path}（可用 --undo 撤销）")
+        engine.report()
+        print("--- 所有操作完成 ---")
+        send_completion_notification(True, f"JAV监视结束：成功处理{processed_count}个文件，{error_count}个错误")
+        return
+    manifest_path = os.path.join(work_dir, MANIFEST_FILENAME)
+    checkpoint_path = os.path.join(work_dir, CHECKPOINT_FILENAME)
+    plan_path = os.path.join(work_dir, PLAN_FILENAME)
+    if restart:
+        for path in (manifest_path, checkpoint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    scan_state = ScanState(scan_state_path, full_rescan, recheck)
+    cache = MetadataCache(cache_path, cache_ttl_days, miss_ttl_days)
+    index = OfflineIndex(index_path) if index_path and os.path.exists(index_path) else None
+    checkpoint = ResolveCheckpoint(checkpoint_path)
+    if checkpoint.resolved:
+        print(f"从检查点恢复: 已解析 {len(checkpoint.resolved)} 个番号，将跳过这些番号的查询\n")
+    engine = LookupEngine(workers, lambda name: open_rate_limiter(rate_limit_path, request_rate, request_burst, name),
+                          min_rate=min_request_rate, max_rate=max_request_rate,
+                          retries=retries, providers=providers, hedge_after=hedge_after)
+    prefixes = PrefixIndex([cache, index], prefix_seed_path) if check_prefixes else None
+    events = EventLog(events_path) if events_path else None
+    resolver = MetadataResolver(cache, engine, index, checkpoint, refresh, offline, lookahead,
+                                prefixes=prefixes, skip_implausible=skip_implausible, events=events)
+    groups = {}
+    plan = []
+    file_count = 0
+    canonical_count = 0
     processed_count = 0
     error_count = 0
-    
-    # 递归扫描所有子文件夹
-    for root, dirs, files in os.walk(target_directory):
-        # 排除名为 no_need 的文件夹
-        if 'no_need' in dirs:
-            dirs.remove('no_need')
-            
-        files_in_directory = sorted(files)
-        for filename in files_in_directory:
-            original_path = os.path.join(root, filename)
-            # 跳过隐藏/系统文件（如 .DS_Store、AppleDouble 文件 ._ 开头等）
-            if filename.startswith('.'):
-                continue
-            # 跳过目录和非文件项
-            if not os.path.isfile(original_path):
-                continue
-            # 检查是否为支持的文件（视频、音频、字幕）
-            _, ext = os.path.splitext(filename)
-            if not ext or ext.lower() not in SUPPORTED_EXTENSIONS:
-                continue
-            jav_id = extract_id_from_filename(filename)
-            if not jav_id:
+    manifest_file = None
+
+    try:
+        # 阶段一：扫描。候选文件边扫描边写入扫描清单，并立即交给解析阶段；
+        # 扫描清单完整写入后，重新运行时直接复用，不再遍历目录
+        if os.path.exists(manifest_path):
+            print(f"复用上次运行的扫描清单: {manifest_path}\n")
+            candidate_stream = read_jsonl(manifest_path)
+        else:
+            print(f"扫描目录: {target_directory}\n")
+            candidate_stream = scan_candidates(os.path.abspath(target_directory), scan_state, scan_workers, events)
+            manifest_file = open(manifest_path + '.tmp', 'w', encoding='utf-8')
+
+        # 阶段二：解析。按番号分组，同一番号的所有文件只查询一次；
+        # 检查点、缓存和索引都未命中的番号进入预取窗口，由令牌桶控制请求速率
+        pending = []
+        bar = ProgressBar("扫描") if progress else None
+        for candidate in candidate_stream:
+            if bar is not None:
+                bar.advance()
+            if manifest_file is not None:
+                manifest_file.write(json.dumps(candidate, ensure_ascii=False) + '\n')
+            # 已是规范命名的文件直接跳过，不查询也不等待（--recheck 时重新校验）
+            if not recheck and is_canonical_filename(candidate['filename']):
+                original_path = os.path.join(candidate['root'], candidate['filename'])
+                scan_state.record_file(original_path, candidate['stat'], 'canonical')
+                if events is not None:
+                    events.emit('skipped', path=original_path, jav_id=candidate['jav_id'], reason='canonical')
+                canonical_count += 1
                 continue
+            file_count += 1
+            jav_id = candidate['jav_id']
+            files = groups.get(jav_id)
+            if files is None:
+                files = groups[jav_id] = []
+                pending.append((resolver.begin(jav_id, candidate.get('rule', 'standard')), files))
+            files.append(candidate)
 
-            # 检测分段标识（如 A/B/C/D 或 1/2/3/4），位置独立于番号出现形式
-            part_suffix = ''
-            base_no_ext, _ext_dummy = os.path.splitext(filename)
-            tokens = re.findall(r'([A-Za-z0-9]+)', base_no_ext)
-            if tokens:
-                last_token = tokens[-1]
-                if re.fullmatch(r'(?i)[A-D]|[1-4]', last_token):
-                    part_suffix = f' {last_token.upper()}'
+        if manifest_file is not None:
+            manifest_file.close()
+            os.replace(manifest_path + '.tmp', manifest_path)
+        if scan_state.skipped_dirs or scan_state.skipped_files:
+            print(f"增量扫描: 跳过未变化的 {scan_state.skipped_dirs} 个目录、{scan_state.skipped_files} 个文件\n")
+        if canonical_count:
+            print(f"已是规范命名，跳过 {canonical_count} 个文件\n")
 
-            print(f"[处理] {filename}")
-            print(f" ├─ 提取番号: {jav_id}")
+        if bar is not None:
+            bar.close()
+            bar = ProgressBar("解析", file_count)
+        # 按番号首次出现的顺序依次处理查询结果，并生成该番号下所有文件的重命名计划；低置信度番号最后处理
+        plan, error_count = resolve_groups(resolver, pending, scan_state, bar)
+        if bar is not None:
+            bar.close()
+    finally:
+        if manifest_file is not None:
+            manifest_file.close()
+        engine.close()
+        checkpoint.close()
 
-            try:
-                # 使用 jvav 库获取信息
-                code, info = jav_db.get_av_by_id(jav_id, is_nice=False, is_uncensored=False)
-                
-                if code != 200 or not info or not info.get('title'):
-                    print(" └─ 结果: 未找到远程信息，尝试本地优化...")
-                    # 进行本地文件名优化
-                    optimized_base = base_no_ext
-                    for pattern in FILENAME_CLEAN_PATTERNS:
-                        optimized_base = re.sub(pattern, '', optimized_base)
-                    
-                    if optimized_base == base_no_ext:
-                        print(" └─ 结果: 本地无优化建议，跳过.\n")
-                        error_count += 1
-                        continue
-                    
-                    new_filename = f"{optimized_base}{ext}"
-                else:
-                    # 分支：成功获取远程信息，构建标准格式
-                    # 清理标题
-                    raw_title = info.get('title', '')
-                    # 优化：移除指定的关键词
-                    for keyword in TITLE_EXCLUDE_KEYWORDS:
-                        raw_title = raw_title.replace(keyword, '')
-                    
-                    clean_title = sanitize_filename(raw_title.strip())
-                    # 优化：如果标题过长，进行截断
-                    if len(clean_title) > 50:
-                        clean_title = clean_title[:50] + "..."
-
-                    # 构建新文件名，追加分段标识
-                    stars = info.get('stars') or []
-                    if stars:
-                        # 只取第一个演员并做非法字符清理
-                        first_actor = stars[0]
-                        name = first_actor.get('name') if isinstance(first_actor, dict) else str(first_actor)
-                        actor_name = sanitize_filename(name)
-                        # 若标题已以" 空格+演员"结尾，则不再添加方括号演员
-                        if clean_title.endswith(f' {actor_name}'):
-                            new_filename = f"{jav_id} {clean_title}{part_suffix}{ext}"
-                        else:
-                            # 分段标识加在片名后、演员名前
-                            new_filename = f"{jav_id} {clean_title}{part_suffix} [{actor_name}]{ext}"
-                    else:
-                        new_filename = f"{jav_id} {clean_title}{part_suffix}{ext}"
-                
-                new_path = os.path.join(root, new_filename)
-
-                print(f" └─ 计划重命名为: {new_filename}")
-
-                if not dry_run:
-                    if os.path.exists(new_path):
-                        print(" └─ 操作: 失败 - 目标文件名已存在，为避免覆盖，已跳过.\n")
-                        error_count += 1
-                        continue
-                    os.rename(original_path, new_path)
-                    print(" └─ 操作: 重命名成功！\n")
-                    processed_count += 1
-                else:
-                    print("") # 在预览模式下打印一个换行
-                    processed_count += 1
+    # 阶段三：应用。预览模式只保存计划，可审阅后通过 --execute --apply-plan 直接执行；
+    # 执行前在内存中检查整个计划的目标冲突
+    write_jsonl(plan_path, plan)
+    if dry_run:
+        plan, conflicts = split_plan_conflicts(plan)
+        error_count += report_plan_conflicts(conflicts, scan_state, events)
+        processed_count = len(plan)
+        print(f"重命名计划已保存: {plan_path}")
+        print(f"审阅无误后可执行: python jav_renamer.py --execute --apply-plan \"{plan_path}\"\n")
+    else:
+        print("--- 开始执行重命名 ---\n")
+        journal = RenameJournal(journal_path or default_journal_path(work_dir))
+        bar = ProgressBar("重命名", len(plan)) if progress else None
+        try:
+            processed_count, apply_errors = apply_rename_plan(plan, dry_run=False, scan_state=scan_state, journal=journal,
+                                                              events=events, progress=bar)
+        finally:
+            if bar is not None:
+                bar.close()
+            journal.close()
+        error_count += apply_errors
+        print(f"重命名日志已保存: {journal.path}（可用 --undo 撤销）\n")
+    scan_state.finish()
+    scan_state.close()
+    if events is not None:
+        events.close()
+        print(f"事件流已保存: {events.path}（{events.count} 条）")
 
-            except Exception as e:
-                print(f" └─ 错误: 查询或处理 {jav_id} 时发生错误: {e}\n")
-                error_count += 1
-            
-            # 礼貌地等待，避免IP被封
-            time.sleep(3)
+    # 完整跑完后清理扫描清单和检查点，下次运行重新扫描
+    for path in (manifest_path, checkpoint_path):
+        if os.path.exists(path):
+            os.remove(path)
 
     print("--- 所有操作完成 ---")
+    if canonical_count:
+        print(f"已是规范命名: {canonical_count} 个文件")
+    hit_rate = cache.hit_rate()
+    if hit_rate is not None:
+        print(f"缓存命中: {cache.hits}/{cache.hits + cache.misses} ({hit_rate:.1%})")
+    if index is not None:
+        print(f"离线索引命中: {index.hits} 个番号")
+        index.close()
+    if cache.negative_hits:
+        print(f"负缓存命中: {cache.negative_hits} 个番号，跳过远程查询")
+    if resolver.deferred or resolver.implausible:
+        print(f"前缀未知的低置信度番号: 延后查询 {resolver.deferred} 个，跳过 {resolver.implausible} 个")
+    engine.report()
+    print(f"按番号分组: {file_count} 个文件 / {len(groups)} 个番号，节省 {file_count - len(groups)} 次远程请求")
+    cache.close()
     # 发送完成通知
     if dry_run:
         send_completion_notification(True, f"JAV预览完成：处理{processed_count}个文件，{error_count}个错误")
@@ -254,6 +2475,79 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="JAV 文件重命名工具")
     parser.add_argument("directory", default=".", nargs="?", help="要扫描的目录路径 (默认为当前目录)")
     parser.add_argument("--execute", action="store_true", help="执行实际的文件重命名操作，否则只进行预览。" )
+    parser.add_argument("--cache-path", default=None, help=f"元数据缓存数据库路径 (默认: {DEFAULT_CACHE_PATH}；提供方含 stub 时默认使用内存缓存)")
+    parser.add_argument("--cache-ttl", type=float, default=DEFAULT_CACHE_TTL_DAYS, help=f"缓存有效期（天），<=0 表示永不过期 (默认: {DEFAULT_CACHE_TTL_DAYS})")
+    parser.add_argument("--miss-ttl", type=float, default=DEFAULT_MISS_TTL_DAYS, help=f"远程查不到的番号首次重试间隔（天），之后每失败一次翻倍，最长 {MAX_MISS_TTL_DAYS} 天 (默认: {DEFAULT_MISS_TTL_DAYS})")
+    parser.add_argument("--refresh", action="store_true", help="忽略已有缓存（含负缓存），强制重新获取远程元数据并更新缓存")
+    parser.add_argument("--rate", type=float, default=DEFAULT_REQUEST_RATE, help="远程请求的初始速率（次/秒，默认: 1/3），运行中会根据响应自适应调整")
+    parser.add_argument("--min-rate", type=float, default=DEFAULT_MIN_REQUEST_RATE, help="自适应限速的速率下限（次/秒，默认: 1/30）")
+    parser.add_argument("--max-rate", type=float, default=DEFAULT_MAX_REQUEST_RATE, help=f"自适应限速的速率上限（次/秒，默认: {DEFAULT_MAX_REQUEST_RATE}）；设为与 --rate 相同可关闭提速")
+    parser.add_argument("--retries", type=int, default=DEFAULT_LOOKUP_RETRIES, help=f"限流、服务端错误或异常时的重试次数 (默认: {DEFAULT_LOOKUP_RETRIES})")
+    parser.add_argument("--burst", type=int, default=DEFAULT_REQUEST_BURST, help=f"令牌桶允许的突发请求数 (默认: {DEFAULT_REQUEST_BURST})")
+    parser.add_argument("--rate-limit-db", default=DEFAULT_RATE_LIMIT_PATH, help=f"主机级共享限速库路径，同时运行的所有实例共用一个请求速率上限 (默认: {DEFAULT_RATE_LIMIT_PATH})")
+    parser.add_argument("--local-rate-limit", action="store_true", help="不使用共享限速库，只在本进程内限速")
+    parser.add_argument("--workers", type=int, default=DEFAULT_LOOKUP_WORKERS, help=f"并发查询线程数 (默认: {DEFAULT_LOOKUP_WORKERS})")
+    parser.add_argument("--lookahead", type=int, default=DEFAULT_LOOKAHEAD, help=f"预取深度：最多提前发出多少个番号的远程查询 (默认: {DEFAULT_LOOKAHEAD})")
+    parser.add_argument("--work-dir", default=None, help=f"扫描清单、检查点和重命名计划的保存目录 (默认: {DEFAULT_WORK_ROOT}/<目录哈希>，提供方含 stub 时为 <目录哈希>-stub)")
+    parser.add_argument("--restart", action="store_true", help="丢弃上次未完成运行的扫描清单和检查点，从头开始")
+    parser.add_argument("--recheck", action="store_true", help="对已是规范命名的文件也重新查询校验")
+    parser.add_argument("--scan-state", default=DEFAULT_SCAN_STATE_PATH, help=f"增量扫描状态数据库路径 (默认: {DEFAULT_SCAN_STATE_PATH})")
+    parser.add_argument("--full-rescan", action="store_true", help="忽略增量扫描状态，完整扫描所有目录和文件")
+    parser.add_argument("--scan-workers", type=int, default=DEFAULT_SCAN_WORKERS, help=f"并发列目录的线程数 (默认: {DEFAULT_SCAN_WORKERS})")
+    parser.add_argument("--apply-plan", default=None, metavar="PLAN", help="直接应用此前预览生成的重命名计划 (plan.jsonl)，不扫描也不联网")
+    parser.add_argument("--index-path", default=DEFAULT_INDEX_PATH, help=f"离线元数据索引数据库路径 (默认: {DEFAULT_INDEX_PATH})")
+    parser.add_argument("--import-index", nargs="+", default=None, metavar="DUMP", help="把批量导出的 CSV/TSV/JSONL（可 .gz 压缩）流式导入离线索引后退出")
+    parser.add_argument("--offline", action="store_true", help="完全不联网，只使用缓存和离线索引解析番号")
+    parser.add_argument("--prefix-seed", default=DEFAULT_PREFIX_SEED_PATH, help="已知厂牌前缀种子列表（以空白分隔，# 之后为注释）(默认: 脚本同目录下的 jav_prefixes.txt)")
+    parser.add_argument("--skip-unknown-prefixes", action="store_true", help="前缀未知的低置信度番号直接跳过远程查询（默认延后到最后查询）")
+    parser.add_argument("--no-prefix-check", action="store_true", help="不核对番号前缀，所有番号按出现顺序查询")
+    parser.add_argument("--provider", action="append", default=None, metavar="NAME", help=f"远程元数据提供方，可重复指定，按顺序对冲，第一个为首选（可选: {', '.join([*JVAV_PROVIDERS, 'stub'])}；默认: javdb）")
+    parser.add_argument("--hedge-after", type=float, default=DEFAULT_HEDGE_AFTER_SECONDS, help=f"首选提供方超过该秒数未返回时并发查询下一个提供方 (默认: {DEFAULT_HEDGE_AFTER_SECONDS})")
+    parser.add_argument("--stub-data", default=None, metavar="DUMP", help="stub 提供方的数据文件（格式同 --import-index，使用 stub 时必填）")
+    parser.add_argument("--stub-latency", type=float, default=0.0, help="stub 提供方模拟的响应延迟（秒）")
+    parser.add_argument("--journal", default=None, help="重命名日志路径 (默认: 工作目录下的 journal-<时间戳>.jsonl)")
+    parser.add_argument("--undo", default=None, metavar="JOURNAL", help="按重命名日志撤销整批重命名（需配合 --execute 实际执行），不扫描也不联网")
+    parser.add_argument("--undo-force", action="store_true", help="撤销时有条目核对失败（文件缺失或 inode 不一致）仍撤销其余条目（默认整批不撤销）")
+    parser.add_argument("--watch", action="store_true", help="常驻监视目录（仅 Linux，基于 inotify），只处理之后新写入或移入的文件")
+    parser.add_argument("--settle", type=float, default=DEFAULT_SETTLE_SECONDS, help=f"监视模式下文件大小持续多少秒不变才视为写入完成 (默认: {DEFAULT_SETTLE_SECONDS})")
+    parser.add_argument("--events", default=None, metavar="EVENTS", help="把每个决策（扫描、识别、缓存命中、远程获取、重命名、跳过、错误及耗时）写入 JSONL 事件流")
+    parser.add_argument("--quiet", action="store_true", help="安静模式：不逐个输出文件，只在 stderr 显示单行进度条（速率与预计剩余时间）")
+    parser.add_argument("--benchmark-extract", type=int, nargs="?", const=100000, default=None, metavar="N", help="用 N 个合成文件名对比番号提取的速度与准确率后退出 (默认: 100000)")
     args = parser.parse_args()
+    if args.rate <= 0 or args.min_rate <= 0:
+        parser.error("--rate 和 --min-rate 必须大于 0")
+    if args.benchmark_extract is not None:
+        benchmark_extractor(args.benchmark_extract)
+        sys.exit(0)
+    if args.import_index:
+        offline_index = OfflineIndex(args.index_path)
+        for dump_path in args.import_index:
+            started = time.monotonic()
+            count = offline_index.import_file(dump_path)
+            print(f"已导入 {dump_path}: {count} 条，耗时 {time.monotonic() - started:.1f}s")
+        offline_index.close()
+        sys.exit(0)
+
+    try:
+        providers = build_providers(args.provider or ['javdb'], args.stub_data, args.stub_latency)
+    except ValueError as e:
+        parser.error(str(e))
 
-    main(dry_run=not args.execute, target_directory=args.directory)
\ No newline at end of file
+    # 安静模式下逐文件输出全部丢弃，只保留 stderr 上的进度条
+    quiet_output = open(os.devnull, 'w', encoding='utf-8') if args.quiet else None
+    with redirect_stdout(quiet_output) if quiet_output is not None else nullcontext():
+        main(dry_run=not args.execute, target_directory=args.directory,
+             cache_path=args.cache_path, cache_ttl_days=args.cache_ttl, refresh=args.refresh,
+             miss_ttl_days=args.miss_ttl,
+             request_rate=args.rate, request_burst=args.burst, workers=args.workers,
+             min_request_rate=args.min_rate, max_request_rate=args.max_rate, retries=args.retries,
+             work_dir=args.work_dir, restart=args.restart, apply_plan=args.apply_plan,
+             recheck=args.recheck, scan_state_path=args.scan_state, full_rescan=args.full_rescan,
+             scan_workers=args.scan_workers, index_path=args.index_path, offline=args.offline,
+             lookahead=args.lookahead, journal_path=args.journal, undo=args.undo, undo_force=args.undo_force,
+             watch=args.watch, settle_seconds=args.settle,
+             rate_limit_path=None if args.local_rate_limit else args.rate_limit_db,
+             prefix_seed_path=args.prefix_seed, check_prefixes=not args.no_prefix_check,
+             skip_implausible=args.skip_unknown_prefixes,
+             providers=providers, hedge_after=args.hedge_after,
+             events_path=args.events, progress=args.quiet)